@@ -1,14 +1,12 @@
 import streamlit as st
 import time
-import os
-import shutil
-import pymupdf
 import json
 import datetime
 import logging
-import sys
 
-from predict_output import clear_prediction_caches, predict_output
+from jobs import JOB_FAILED
+from predict_output import GROUNDING_SERVER_URL, cached_document_pages, get_job, submit_prediction, submit_prepare
+from workspace import Workspace, cleanup_stale_workspaces
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -150,14 +148,18 @@ def get_llm_model(device):
 
 # Initialize models with error handling
 try:
-    with st.spinner("Loading models... This might take a few minutes."):
-        layout_predictor = get_layout_predictor()
-        model = get_ocr_model()
-        pipe = get_llm_model("cuda")
+    if GROUNDING_SERVER_URL:
+        # a shared grounding server (grounding_server.py) holds the models
+        layout_predictor = model = pipe = None
+    else:
+        with st.spinner("Loading models... This might take a few minutes."):
+            layout_predictor = get_layout_predictor()
+            model = get_ocr_model()
+            pipe = get_llm_model("cuda")
         
-        if not all([layout_predictor, model, pipe]):
-            st.error("Failed to initialize one or more models. Please try again later.")
-            st.stop()
+            if not all([layout_predictor, model, pipe]):
+                st.error("Failed to initialize one or more models. Please try again later.")
+                st.stop()
 except Exception as e:
     logger.error(f"Error initializing models: {e}")
     st.error("Error initializing models. Please try again later.")
@@ -199,6 +201,19 @@ def draw_points(image, bboxes, color):
         draw.ellipse((cx-r, cy-r, cx+r, cy+r), outline=color, width=width, fill=color)
     return img
 
+# Seconds between two polls of a running grounding job, and what its stages are shown as
+JOB_POLL_SECONDS = 0.5
+JOB_STAGE_LABELS = {
+    "ocr": "reading the document (OCR)",
+    "layout": "detecting layout blocks",
+    "llm": "generating the answer",
+    "matching": "grounding the answer",
+    "server": "waiting for the grounding server",
+}
+
+def rerun():
+    st.rerun() if hasattr(st, "rerun") else st.experimental_rerun()
+
 # model_type = st.sidebar.checkbox("Use LLM Model", value=False)
 # model_type = "llm" if model_type else "inhouse"
 
@@ -331,6 +346,13 @@ with col_center:
 quote_progress = min((time.time() - st.session_state.last_quote_time) / 2, 1.0)
 st.progress(quote_progress)
 
+# Per-session workspace for the uploaded documents (removed with the session or after WORKSPACE_TTL)
+if "workspace" not in st.session_state:
+    cleanup_stale_workspaces()
+    st.session_state["workspace"] = Workspace()
+workspace = st.session_state["workspace"]
+workspace.touch()
+
 col1, col2 = st.columns([1, 2])
 
 with col1:
@@ -339,60 +361,63 @@ with col1:
     uploaded_file = st.file_uploader("Choose an image", type=["png", "jpg", "jpeg", "pdf"])
     show_uploaded = False
     if uploaded_file:
-        current_dir = os.getcwd()
-        temp_output_folder = os.path.join(current_dir, "temp_output_folder/")
-        # delete the temp_output_folder
-        if os.path.exists(temp_output_folder):
-            shutil.rmtree(temp_output_folder)
-        
-        clear_prediction_caches()  # Clear caches when new file is uploaded
-
+        # predictions are cached per document content, so a new upload needs no cache clearing
         document_type = "image"
+        pages = None
         if uploaded_file.type == "application/pdf":
-            # save the uploaded file to a temp file
-            temp_file_path = os.path.join(current_dir, "temp_file.pdf")
-            # delete the temp_file_path
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-            with open(temp_file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            if not os.path.exists(temp_output_folder):
-                os.makedirs(temp_output_folder)
-            pages = 0
-            doc = pymupdf.open(temp_file_path)  # open document
-            for page in doc:  # iterate through the pages
-                pages += 1
-                pix = page.get_pixmap()  # render page to an image
-                pix.save(f"{temp_output_folder}/{page.number}.png")
-            if(pages == 1):
+            document = workspace.add_document(uploaded_file.getvalue(), "pdf", ".pdf")
+            # rendered once in memory; OCR and layout reuse these page buffers
+            pages = cached_document_pages(document)
+            if(len(pages) == 1):
                 document_type = "image"
-                document_path = os.path.join(temp_output_folder, "0.png")
-                uploaded_file = os.path.join(temp_output_folder, "0.png")
-                image = Image.open(uploaded_file).convert("RGB")
             else:
                 document_type = "pdf"
         if document_type == "image":
-            image = Image.open(uploaded_file).convert("RGB")
+            if pages is None:
+                image = Image.open(uploaded_file).convert("RGB")
+            else:
+                image = Image.fromarray(pages[0])
             show_uploaded = st.checkbox("Show Uploaded Image", value=True)
             if show_uploaded:
                 st.image(image, caption="Uploaded Image", use_container_width=True)
-            # Save uploaded image to a temp file for predict_output
-            temp_file_path = "sample.png"
-            image.save(temp_file_path)
+            # Store the uploaded image in the session workspace for predict_output
+            document = workspace.add_image(image)
         else:
             document_type = "pdf"
-            document_path = uploaded_file.name
             show_uploaded = st.checkbox("Show Uploaded PDF Pages", value=True)
-            if show_uploaded and temp_output_folder is not None:
-                page_files = sorted([f for f in os.listdir(temp_output_folder) if f.endswith('.png')], key=lambda x: int(x.split('.')[0]))
-                if page_files:
-                    st.image([os.path.join(temp_output_folder, f) for f in page_files], caption=[f"Page {i}" for i in range(len(page_files))], use_container_width=True)
+            if show_uploaded:
+                if pages:
+                    st.image(list(pages), caption=[f"Page {i}" for i in range(len(pages))], use_container_width=True)
                 else:
                     st.info("No PDF pages found.")
             image = "Uploaded PDF"
+        # drop earlier uploads of this session, except those a grounding or prepare job is still reading
+        keep = [document]
+        running_job = st.session_state.get('grounding_job')
+        if running_job:
+            keep.append(running_job['document'])
+        previous_prepare = st.session_state.get("prepare_job")
+        if previous_prepare:
+            previous_job = get_job(previous_prepare['id'])
+            if previous_job is not None and not previous_job.done:
+                keep.append(previous_prepare['document'])
+        workspace.remove_documents(keep=keep)
+        # start OCR in the background now, while the question is being typed
+        if st.session_state.get("prepared_document") != document.digest:
+            st.session_state["prepared_document"] = document.digest
+            st.session_state["prepare_job"] = {
+                'id': submit_prepare(document, layout_predictor, model),
+                'document': document
+            }
+        prepare_job = get_job(st.session_state["prepare_job"]['id']) if st.session_state.get("prepare_job") else None
+        if prepare_job is not None:
+            if prepare_job.done:
+                st.caption("Document read (OCR ready)." if prepare_job.status != JOB_FAILED else "Document OCR will run with the question.")
+            else:
+                st.caption("Reading the document in the background...")
     else:
         image = "Not Uploaded"
-        temp_output_folder = None
+        pages = None
         st.image("https://placehold.co/400x300?text=Upload+Image", caption="Uploaded Image", use_container_width=True)
 
     st.subheader("2. Ask a question")
@@ -428,7 +453,6 @@ with st.sidebar:
             st.session_state['all_chats'].append(list(st.session_state['chat_history']))
         st.session_state['chat_history'] = []
         st.session_state['current_chat_index'] = None
-        clear_prediction_caches()  # Clear caches when new chat is started
     if st.button('🗑️ Clear Chat', key='sidebar_clear_chat'):
         st.session_state['chat_history'] = []
         st.session_state['current_chat_index'] = None
@@ -474,12 +498,48 @@ with col2:
         print(image)
         print(question)
     if run_demo and image!="Not Uploaded" and (question):
-        # Use text input only
-        q = question
-        with st.spinner("Running Visual Grounding..."):
-            answer, block_bboxes, line_bboxes, word_bboxes, point_bboxes, current_page = predict_output(
-                temp_file_path, q, pipe, layout_predictor, model, model_type, document_type
-            )
+        # Use text input only; grounding runs on the job queue and this script only polls it
+        st.session_state['grounding_job'] = {
+            'id': submit_prediction(document, question, pipe, layout_predictor, model, model_type),
+            'question': question,
+            'document': document
+        }
+
+    grounding_job = st.session_state.get('grounding_job')
+    job = get_job(grounding_job['id']) if grounding_job else None
+    # results are only drawn on the document they were computed for
+    same_document = grounding_job is not None and image != "Not Uploaded" and grounding_job['document'].digest == document.digest
+    if grounding_job and (job is None or job.status == JOB_FAILED):
+        logger.error(f"Grounding job failed: {job.error if job else 'job not found'}")
+        st.error("Visual Grounding failed. Please try again.")
+        del st.session_state['grounding_job']
+        job = None
+    elif job is not None and job.done and not same_document:
+        st.warning("The document changed while Visual Grounding was running. Please ask again.")
+        del st.session_state['grounding_job']
+        job = None
+    elif job is not None and not job.done:
+        st.info(f"Running Visual Grounding... {JOB_STAGE_LABELS.get(job.stage, 'waiting for a worker')}")
+        partial = job.partial
+        if partial is not None:
+            # the answer streamed so far, with the lines it provisionally matches
+            st.markdown(f"""
+            <div style='background: #f8fafc; border-radius: 10px; padding: 1em 1.5em; margin-bottom: 0.7em; border: 1.5px dashed #4F8BF9;'>
+                <div style='color:#4F8BF9; font-weight:600;'>Q{len(chat_to_display)+1}: {grounding_job['question']}</div>
+                <div style='color:#222; margin-top:0.5em;'><b>Answer:</b> {partial['answer']}▌</div>
+            </div>
+            """, unsafe_allow_html=True)
+            if partial['line_bboxes'] and same_document:
+                provisional_image = Image.fromarray(pages[partial['current_page']]) if partial['current_page'] != -1 else image
+                st.image(draw_bboxes(provisional_image, partial['line_bboxes'], color="#F97B4F"),
+                         caption="Line Level (provisional)", width=400)
+        time.sleep(JOB_POLL_SECONDS)
+        rerun()
+
+    if job is not None and job.done and image!="Not Uploaded":
+        del st.session_state['grounding_job']
+        q = grounding_job['question']
+        answer, block_bboxes, line_bboxes, word_bboxes, point_bboxes, current_page = job.result
 
         # Append Q&A to chat history
         st.session_state['chat_history'].append({
@@ -496,7 +556,7 @@ with col2:
         print(answer)
 
         if(current_page != -1):
-            image = Image.open(os.path.join(temp_output_folder, f"{current_page}.png")).convert("RGB")
+            image = Image.fromarray(pages[current_page])
         print("--------------------------------")
         print(image)
 
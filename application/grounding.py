@@ -0,0 +1,663 @@
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import time
+
+import numpy as np
+import requests
+from PIL import Image
+
+from matching import get_page_number, get_word_level_matches, match_region_ids, match_region_ids_batch, rank_matches
+from region_index import RegionIndex
+from retrieval import CONTEXT_RETRY_FACTOR, CONTEXT_TOKEN_BUDGET, retrieve_context
+from text_layer import extract_text_layer
+from ocr_cache import BLOCK_LINES_CONFIG, DOCTR_CONFIG, LAYOUT_CONFIG, OCRCache
+from rasterize import RenderedPages
+from ocr_utils import (BLOCK_TEXT_FROM_LINES, OCR_BATCH_SIZE, get_batched_block_predictions, get_block_predictions,
+                       get_block_predictions_from_lines, get_paged_line_predictions, load_document_pages)
+from workspace import document_cache_key
+
+
+MAX_BLOCK_MATCHES = 2
+MAX_LINE_MATCHES = 5
+LEVEL = "line"
+# Number of prompts generated together by the LLM pipeline in ground_batch
+LLM_BATCH_SIZE = 4
+# Block text from the line OCR (BLOCK_TEXT_FROM_LINES) or by re-OCRing every crop (BLOCK_TEXT_FROM_OCR)
+BLOCK_TEXT_MODE = BLOCK_TEXT_FROM_LINES
+# Re-OCR the crop of layout blocks that no OCR line falls into (BLOCK_TEXT_FROM_LINES only)
+REOCR_EMPTY_BLOCKS = False
+# PDFs: use the embedded text layer and OCR only pages where it is missing or untrusted
+LAZY_PDF_OCR = True
+# Lazy mode: OCR the answer's page on demand and ground on its docTR lines (off: trusted text-layer boxes are exact)
+OCR_CANDIDATE_PAGES = False
+# Documents whose pages, predictions and indexes a GroundingEngine keeps in memory (least recently used are dropped)
+MAX_CACHED_DOCUMENTS = int(os.environ.get("DRISHTIKON_MAX_CACHED_DOCUMENTS", "16"))
+# Bytes of rendered pages a GroundingEngine keeps; pages of the least recently used documents are
+# released beyond it (their predictions and indexes stay) and rendered again if needed
+MAX_CACHED_PAGE_BYTES = int(os.environ.get("DRISHTIKON_MAX_CACHED_PAGE_MB", "2048")) * 2**20
+# Streamed answers: least seconds between two provisional line matches of the partial answer
+PROVISIONAL_MATCH_SECONDS = float(os.environ.get("DRISHTIKON_PROVISIONAL_MATCH_SECONDS", "1.0"))
+
+LLM_MODEL_ID = "meta-llama/Meta-Llama-3.1-8B-Instruct"
+# What the prompt asks the LLM to answer when the context does not hold the answer
+NOT_FOUND_ANSWER = "Answer not found in context"
+
+# Model names used by GroundingEngine
+LAYOUT_MODEL = "layout"
+OCR_MODEL = "ocr"
+LLM_MODEL = "llm"
+
+
+def load_layout_predictor():
+    from surya.layout import LayoutPredictor
+    return LayoutPredictor()
+
+
+def load_ocr_predictor():
+    from doctr.models import ocr_predictor
+    return ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+
+
+def load_llm_pipeline():
+    from transformers import pipeline
+    return pipeline("text-generation", model=LLM_MODEL_ID, device_map="auto", token=os.environ.get("HF_TOKEN"))
+
+
+class ModelRegistry:
+    """Named models shared by everything running in one process.
+
+    A model is either added already loaded (`add`) or registered with a loader that runs on
+    first `get`; after that the same instance is returned to every caller. `using(*names)`
+    serializes the work on each model across threads, so different models can run at once.
+    """
+
+    def __init__(self, loaders=None):
+        self._loaders = dict(loaders or {})
+        self._models = {}
+        self._lock = threading.Lock()
+        self._model_locks = {}
+        self._model_locks_lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        """Registry loading the layout, OCR and LLM models of the demo on first use."""
+        return cls({LAYOUT_MODEL: load_layout_predictor, OCR_MODEL: load_ocr_predictor, LLM_MODEL: load_llm_pipeline})
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+
+    def add(self, name, model):
+        with self._lock:
+            self._models[name] = model
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._models:
+                if name not in self._loaders:
+                    raise KeyError(f"No model registered as '{name}'")
+                self._models[name] = self._loaders[name]()
+            return self._models[name]
+
+    def loaded(self):
+        """Names of the models loaded so far."""
+        return sorted(self._models)
+
+    @contextlib.contextmanager
+    def using(self, *names):
+        """Hold the locks of the named models (always taken in the same order, so no deadlock)."""
+        with self._model_locks_lock:
+            locks = [self._model_locks.setdefault(name, threading.RLock()) for name in sorted(set(names))]
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+
+
+def get_matched_region_ids(question_text, target_text, index, level):
+    """Return the RegionIndex ids of the top matches at the given level, best first."""
+    if level == "block":
+        max_matches = MAX_BLOCK_MATCHES
+    elif level == "line":
+        max_matches = MAX_LINE_MATCHES
+    region_ids, _ = match_region_ids(question_text, target_text, index, max_matches)
+    return region_ids
+
+
+def ground_answer(predicted_answer, line_index, line_ids, block_index, block_ids, document_type):
+    """Turn matched region ids into the block/line/word/point predictions and page for one answer."""
+    if document_type == "pdf":
+        current_page = get_page_number(block_index, block_ids)
+    else:
+        current_page = -1
+
+    if(current_page != -1):
+        predicted_answer = "Answer predicted from page: " + str(current_page+1) + "\n" + predicted_answer
+
+    block_box_predictions = []
+    for region_id in block_ids:
+        block_box_predictions.append(block_index.regions[region_id]['bbox'])
+
+    line_box_predictions = []
+    for region_id in line_ids:
+        if current_page == -1 or line_index.pages[region_id] == current_page:
+            line_box_predictions.append(line_index.regions[region_id]['bbox'])
+
+    word_box_predictions = get_word_level_matches(predicted_answer, line_index, line_ids)
+    point_box_predictions = get_point_level_matches(block_box_predictions, line_box_predictions, word_box_predictions)
+
+    return predicted_answer, block_box_predictions, line_box_predictions, word_box_predictions, point_box_predictions, current_page
+
+
+def calculate_midpoint_of_bboxes(bboxes):
+
+    if not bboxes:
+        return None
+    
+    # Convert to numpy array for easier manipulation
+    bboxes = np.array(bboxes)
+    
+    # Find the extreme points of all bboxes combined
+    min_x = np.min(bboxes[:, 0])
+    min_y = np.min(bboxes[:, 1])
+    max_x = np.max(bboxes[:, 2])
+    max_y = np.max(bboxes[:, 3])
+    
+    # Calculate midpoint
+    midpoint_x = (min_x + max_x) / 2
+    midpoint_y = (min_y + max_y) / 2
+    
+    return round(midpoint_x, 2), round(midpoint_y, 2)
+
+
+def get_point_level_matches(block_box_predictions, line_box_predictions, word_box_predictions):
+
+    point_box_predictions = []
+
+    if len(block_box_predictions) ==1:
+        try:
+            x, y = calculate_midpoint_of_bboxes(block_box_predictions)
+            point_box_predictions = [[x, y]]
+            # print(x, y)
+        except:
+            try:
+                x, y = calculate_midpoint_of_bboxes(line_box_predictions)
+                point_box_predictions = [[x, y]]
+            except:
+                point_box_predictions = []
+    else:
+        points = []
+        for block_bbox in block_box_predictions:
+            try:
+                x, y = calculate_midpoint_of_bboxes(block_bbox)
+                points.append([x, y])
+            except:
+                continue
+        point_box_predictions = points
+    
+    return point_box_predictions
+
+
+def generate_via_inhouse_model_answer(question, image_path, api_key="VISION-TEAM", max_tokens=512, temperature=0.7, endpoint="http://103.207.148.38:9000/api/v1/chat/upload"):
+    headers = {
+        "x-api-key": api_key  # or whatever the Swagger UI says
+    }
+
+    files = {
+        "image": open(image_path, "rb")
+    }
+
+    data = {
+        "text": question,
+        "max_tokens": str(max_tokens),
+        "temperature": str(temperature)
+    }
+
+    try:
+        response = requests.post(endpoint, headers=headers, files=files, data=data)
+        response.raise_for_status()
+        result = response.json()
+    except requests.exceptions.RequestException as e:
+        return {"error": str(e)}
+
+    return result['response']['choices'][0]['message']['content']
+
+def build_llm_messages(question, context):
+
+    prompt = f"""You are given a question and context. Your task is to find and return the best possible answer to the question using only the context as it is. 
+Do not generate summaries, paraphrased content, or any additional explanations including any preamble and postamble. 
+Return only the exact phrase or sentence fragment from the context that answers the question. 
+If the answer is not found in the context, return: {NOT_FOUND_ANSWER}.
+
+Question: {question}
+Context: {context}
+Answer:
+"""
+
+    return [ {"role": "user", "content": prompt}]
+
+
+def stream_llm_answer(question, context, pipe):
+    """Generate the answer like `generate_llm_answer`, yielding the text pieces as the tokens are produced."""
+    from transformers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors = []
+
+    def generate():
+        try:
+            pipe(build_llm_messages(question, context), max_new_tokens=512, do_sample=True, temperature=0.7, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            # unblock the consumer
+            streamer.end()
+
+    thread = threading.Thread(target=generate, daemon=True)
+    thread.start()
+    yield from streamer
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def generate_llm_answer(question, context, pipe, on_text=None):
+    """Answer a question from the context. With `on_text`, the answer is streamed and
+    `on_text(answer_so_far)` is called as the tokens arrive."""
+    if on_text is not None:
+        answer = ""
+        for text in stream_llm_answer(question, context, pipe):
+            answer += text
+            on_text(answer.strip())
+        return answer.strip()
+
+    messages = build_llm_messages(question, context)
+    result = pipe(messages, max_new_tokens=512, do_sample=True, temperature=0.7)
+    ans = result[0]["generated_text"][1]['content']
+    return ans
+
+
+def generate_llm_answers(questions, contexts, pipe):
+    """Generate answers for several questions, each over its own context, in LLM batches."""
+    if pipe.tokenizer.pad_token_id is None:
+        # Batched generation needs padding; decoder-only models pad on the left
+        pipe.tokenizer.pad_token_id = pipe.tokenizer.eos_token_id
+        pipe.tokenizer.padding_side = "left"
+
+    all_messages = [build_llm_messages(question, context) for question, context in zip(questions, contexts)]
+    results = pipe(all_messages, max_new_tokens=512, do_sample=True, temperature=0.7, batch_size=LLM_BATCH_SIZE)
+    return [result[0]["generated_text"][1]['content'] for result in results]
+
+
+def is_answer_not_found(answer):
+    return NOT_FOUND_ANSWER.lower() in answer.lower()
+
+
+def _report(progress, stage):
+    if progress is not None:
+        progress(stage)
+
+
+class GroundingEngine:
+    """Grounding pipeline without any UI dependency: OCR, layout, indexes, LLM answer and matching.
+
+    Documents are DocumentHandles (see workspace.py). Per document, the rendered pages, line
+    and block predictions and region indexes are computed once and kept in an explicit
+    in-memory cache of the `max_documents` most recently used documents, keyed by content
+    digest. Rendered pages are by far the largest entries: beyond `max_page_bytes`, those of the
+    least recently used documents are released and rendered again when needed. Per-page OCR is
+    also cached on disk through `ocr_cache`. Models come from a
+    ModelRegistry, so one warm set of models serves every caller of the engine, and the work
+    on each model is serialized (`ModelRegistry.using`), so the engine can be shared by
+    threads (e.g. the HTTP server, the app's job queue). A cache entry is computed outside the
+    engine lock: other documents, and finished entries, stay available meanwhile, and callers
+    needing an entry that is being computed wait for that computation instead of repeating it.
+    """
+
+    def __init__(self, models=None, ocr_cache=None, max_documents=MAX_CACHED_DOCUMENTS, max_page_bytes=MAX_CACHED_PAGE_BYTES):
+        self.models = models if models is not None else ModelRegistry.default()
+        self.ocr_cache = ocr_cache if ocr_cache is not None else OCRCache()
+        self.max_documents = max_documents
+        self.max_page_bytes = max_page_bytes
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, document, name, compute):
+        """Per-document memo: return the `name` entry of the document, computing it on a miss.
+
+        Entries are futures: the engine lock only covers the LRU bookkeeping, the first caller
+        runs `compute` without it and concurrent callers wait on its future. A failed compute is
+        not cached. `compute` must not hold a model lock while it needs another entry.
+        """
+        key = document_cache_key(document)
+        with self._lock:
+            entries = self._documents.get(key)
+            if entries is None:
+                entries = self._documents[key] = {}
+                while len(self._documents) > self.max_documents:
+                    self._documents.popitem(last=False)
+            self._documents.move_to_end(key)
+            future = entries.get(name)
+            owner = future is None
+            if owner:
+                future = entries[name] = Future()
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                with self._lock:
+                    if entries.get(name) is future:
+                        del entries[name]
+                future.set_exception(e)
+                raise
+        return future.result()
+
+    def _discard(self, document, name, value):
+        """Drop the `name` entry of the document if it still holds `value`."""
+        key = document_cache_key(document)
+        with self._lock:
+            entries = self._documents.get(key, {})
+            future = entries.get(name)
+            if future is not None and future.done() and future.exception() is None and future.result() is value:
+                del entries[name]
+
+    def _release_pages(self):
+        """Drop the pages entries of the least recently used documents beyond `max_page_bytes`.
+
+        The most recently used document keeps its pages whatever their size.
+        """
+        with self._lock:
+            total = 0
+            for position, entries in enumerate(reversed(self._documents.values())):
+                future = entries.get("pages")
+                if future is None or not future.done() or future.exception() is not None:
+                    continue
+                pages = future.result()
+                total += pages.nbytes if isinstance(pages, RenderedPages) else sum(page.nbytes for page in pages)
+                if position > 0 and total > self.max_page_bytes:
+                    del entries["pages"]
+
+    def clear(self):
+        """Drop all cached documents."""
+        with self._lock:
+            self._documents.clear()
+
+    def document_pages(self, document):
+        """Decode the document once into read-only RGB page arrays shared by OCR, layout and display.
+
+        PDF pages render in the background (RenderedPages); a render that failed is dropped from
+        the cache and started again here. Pages released by the page budget are rendered again.
+        """
+        def compute():
+            return load_document_pages(document.path, document.document_type)
+        pages = self._cached(document, "pages", compute)
+        if getattr(pages, "error", None) is not None:
+            self._discard(document, "pages", pages)
+            pages = self._cached(document, "pages", compute)
+        self._release_pages()
+        return pages
+
+    def line_predictions(self, document):
+        """Line predictions of every page and the index of the last page."""
+        def compute():
+            pages = self.document_pages(document)
+            model = self.models.get(OCR_MODEL)
+            if document.document_type == "pdf" and LAZY_PDF_OCR:
+                # trusted text layer where the PDF has one, docTR only for the remaining pages
+                line_predictions, ocr_page_numbers = extract_text_layer(document.path)
+                with self.models.using(OCR_MODEL):
+                    line_predictions.extend(get_paged_line_predictions(pages, model, cache=self.ocr_cache, config=DOCTR_CONFIG,
+                                                                       batch_size=OCR_BATCH_SIZE, page_numbers=ocr_page_numbers))
+                line_predictions.sort(key=lambda output: output['page'])
+            else:
+                with self.models.using(OCR_MODEL):
+                    line_predictions = get_paged_line_predictions(pages, model, cache=self.ocr_cache, config=DOCTR_CONFIG,
+                                                                  batch_size=OCR_BATCH_SIZE)
+            return line_predictions, len(pages) - 1
+        return self._cached(document, "line_predictions", compute)
+
+    def block_predictions(self, document):
+        """Block predictions of every page from the layout predictor and the line OCR."""
+        def compute():
+            images = [Image.fromarray(page) for page in self.document_pages(document)]
+            layout_predictor = self.models.get(LAYOUT_MODEL)
+            model = self.models.get(OCR_MODEL)
+
+            if BLOCK_TEXT_MODE == BLOCK_TEXT_FROM_LINES:
+                line_predictions, _ = self.line_predictions(document)
+                config = {**BLOCK_LINES_CONFIG, "reocr_empty": REOCR_EMPTY_BLOCKS}
+
+                def build_blocks(page_count, image, block_bboxes):
+                    page_lines = [line for line in line_predictions if line['page'] == page_count]
+                    return get_block_predictions_from_lines(image, layout_predictor, page_lines, model=model,
+                                                            reocr_empty=REOCR_EMPTY_BLOCKS, block_bboxes=block_bboxes)
+            else:
+                config = LAYOUT_CONFIG
+
+                def build_blocks(page_count, image, block_bboxes):
+                    return get_block_predictions(image, layout_predictor, model, block_bboxes=block_bboxes)
+
+            # one layout call per batch of pages instead of per page; cached pages are skipped
+            with self.models.using(LAYOUT_MODEL, OCR_MODEL):
+                page_blocks = get_batched_block_predictions(images, layout_predictor, build_blocks, cache=self.ocr_cache, config=config)
+
+            block_predictions = []
+            for page_count, blocks in enumerate(page_blocks):
+                for output in blocks:
+                    output['page'] = page_count
+                    block_predictions.append(output)
+            return block_predictions
+        return self._cached(document, "block_predictions", compute)
+
+    def line_index(self, document):
+        """Line RegionIndex of the document (shared, not copied, across questions) and the index of the last page."""
+        def compute():
+            line_predictions, pages_count = self.line_predictions(document)
+            return RegionIndex(line_predictions), pages_count
+        return self._cached(document, "line_index", compute)
+
+    def page_line_index(self, document, page_number):
+        """OCR one page on demand (lazy PDF mode) and index its lines."""
+        def compute():
+            pages = self.document_pages(document)
+            with self.models.using(OCR_MODEL):
+                line_predictions = get_paged_line_predictions(pages, self.models.get(OCR_MODEL),
+                                                              cache=self.ocr_cache, config=DOCTR_CONFIG, page_numbers=[page_number])
+            return RegionIndex(line_predictions)
+        return self._cached(document, ("page_line_index", page_number), compute)
+
+    def block_index(self, document):
+        """Block RegionIndex of the document, shared across questions."""
+        return self._cached(document, "block_index", lambda: RegionIndex(self.block_predictions(document)))
+
+    def document_indexes(self, document, progress=None):
+        """Run (cached) OCR for a document and return its line index, block index and LLM context gap."""
+        curr_time = time()
+        _report(progress, "ocr")
+        line_index, pages_count = self.line_index(document)
+        line_time = time()
+        print(f"Done with line predictions in {line_time - curr_time} seconds")
+
+        if(document.document_type == "pdf" and pages_count < 3):
+            _report(progress, "layout")
+            block_index = self.block_index(document)
+            gap = '\n\n\n'
+        else:
+            block_index = line_index
+            gap = '\n'
+        block_time = time()
+        print(f"Done with block predictions in {block_time - line_time} seconds")
+        return line_index, block_index, gap
+
+    def candidate_page_matches(self, question, predicted_answer, document, line_index, line_ids, block_index, block_ids):
+        """In lazy PDF mode, re-match on the docTR OCR of the answer's page if it was read from the text layer.
+
+        Returns (line_index, line_ids, block_index, block_ids), unchanged when there is nothing to refine
+        or the OCRed page has no match.
+        """
+        if not (document.document_type == "pdf" and LAZY_PDF_OCR and OCR_CANDIDATE_PAGES) or len(block_ids) == 0:
+            return line_index, line_ids, block_index, block_ids
+
+        current_page = get_page_number(block_index, block_ids)
+        page_regions = np.flatnonzero(line_index.pages == current_page)
+        if not any(line_index.regions[region_id].get('source') == "text_layer" for region_id in page_regions):
+            return line_index, line_ids, block_index, block_ids
+
+        page_index = self.page_line_index(document, current_page)
+        page_line_ids = get_matched_region_ids(question, predicted_answer, page_index, "line")
+        if len(page_line_ids) == 0:
+            return line_index, line_ids, block_index, block_ids
+
+        if block_index is line_index:
+            block_index = page_index
+            block_ids = get_matched_region_ids(question, predicted_answer, page_index, "block")
+        return page_index, page_line_ids, block_index, block_ids
+
+    def provisional_matches(self, question, line_index, document_type, on_partial):
+        """`on_text` callback for a streamed answer: reports {'answer', 'line_bboxes', 'current_page'}
+        to `on_partial`, re-matching the partial answer to lines at most every PROVISIONAL_MATCH_SECONDS."""
+        last_match = 0.0
+        line_bboxes, current_page = [], -1
+
+        def on_text(partial_answer):
+            nonlocal last_match, line_bboxes, current_page
+            if partial_answer and time() - last_match >= PROVISIONAL_MATCH_SECONDS:
+                line_ids = get_matched_region_ids(question, partial_answer, line_index, "line")
+                current_page = get_page_number(line_index, line_ids) if document_type == "pdf" else -1
+                line_bboxes = [line_index.regions[region_id]['bbox'] for region_id in line_ids
+                               if current_page == -1 or line_index.pages[region_id] == current_page]
+                last_match = time()
+            on_partial({'answer': partial_answer, 'line_bboxes': line_bboxes, 'current_page': current_page})
+        return on_text
+
+    def generate_answer(self, question, block_index, gap, on_text=None):
+        """LLM answer from the regions retrieved for the question (see retrieval.retrieve_context).
+
+        If the answer is not found in a narrowed context, it is generated once more with the
+        budget widened by CONTEXT_RETRY_FACTOR. Returns (answer, ids of the context regions).
+        """
+        context, region_ids = retrieve_context(question, block_index, gap)
+        with self.models.using(LLM_MODEL):
+            answer = generate_llm_answer(question, context, self.models.get(LLM_MODEL), on_text)
+            if is_answer_not_found(answer) and CONTEXT_RETRY_FACTOR > 1 and len(region_ids) < len(block_index):
+                context, region_ids = retrieve_context(question, block_index, gap, CONTEXT_TOKEN_BUDGET * CONTEXT_RETRY_FACTOR)
+                answer = generate_llm_answer(question, context, self.models.get(LLM_MODEL), on_text)
+        print(f"LLM context: {len(region_ids)} of {len(block_index)} regions")
+        return answer, region_ids
+
+    def generate_answers(self, questions, block_index, gap):
+        """Batched `generate_answer`: one retrieved context per question, retries batched too."""
+        retrieved = [retrieve_context(question, block_index, gap) for question in questions]
+        with self.models.using(LLM_MODEL):
+            answers = generate_llm_answers(questions, [context for context, _ in retrieved], self.models.get(LLM_MODEL))
+            retry = [i for i, (answer, (_, region_ids)) in enumerate(zip(answers, retrieved))
+                     if is_answer_not_found(answer) and len(region_ids) < len(block_index)]
+            if retry and CONTEXT_RETRY_FACTOR > 1:
+                for i in retry:
+                    retrieved[i] = retrieve_context(questions[i], block_index, gap, CONTEXT_TOKEN_BUDGET * CONTEXT_RETRY_FACTOR)
+                retried = generate_llm_answers([questions[i] for i in retry], [retrieved[i][0] for i in retry], self.models.get(LLM_MODEL))
+                for i, answer in zip(retry, retried):
+                    answers[i] = answer
+        return answers, [region_ids for _, region_ids in retrieved]
+
+    def prepare(self, document, progress=None):
+        """Run OCR, layout and indexing of a document ahead of its questions (nothing is recomputed later).
+
+        Used as a speculative prefetch on upload; a question arriving meanwhile waits for the
+        entries being computed (see `_cached`) rather than running the same OCR again.
+        """
+        self.document_indexes(document, progress)
+
+    def predict(self, document, question, model_type, progress=None, on_partial=None):
+        """Answer one question on a document and ground it.
+
+        Returns (answer, block_bboxes, line_bboxes, word_bboxes, point_bboxes, current_page).
+        `progress(stage)` is called as the stages ("ocr", "layout", "llm", "matching") start.
+        With `on_partial`, the LLM answer is streamed and `on_partial` receives the partial answer
+        and its provisional line boxes as the tokens arrive (see `provisional_matches`).
+        """
+        predicted_answer = None
+        document_type = document.document_type
+
+        line_index, block_index, gap = self.document_indexes(document, progress)
+
+        curr_time = time()
+        _report(progress, "llm")
+        if model_type == "Drishtikon" or document_type=="pdf":
+            on_text = self.provisional_matches(question, line_index, document_type, on_partial) if on_partial is not None else None
+            predicted_answer, _ = self.generate_answer(question, block_index, gap, on_text)
+        elif model_type == "Param":
+            predicted_answer = generate_via_inhouse_model_answer(question, document.path)
+        llm_time = time()
+        print(f"Done with LLM in {llm_time - curr_time} seconds")
+
+        print("LLM Answer: ", predicted_answer)
+
+        total_algo_time = time()
+        curr_time = time()
+        _report(progress, "matching")
+
+        line_ids = get_matched_region_ids(question, predicted_answer, line_index, "line")
+        block_ids = get_matched_region_ids(question, predicted_answer, block_index, "block")
+        line_index, line_ids, block_index, block_ids = self.candidate_page_matches(
+            question, predicted_answer, document, line_index, line_ids, block_index, block_ids)
+        match_time = time()
+        print(f"Done with match in {match_time - curr_time} seconds")
+
+        outputs = ground_answer(predicted_answer, line_index, line_ids, block_index, block_ids, document_type)
+
+        print(f"Total algo time: {time() - total_algo_time} seconds")
+
+        return outputs
+
+    def ground_batch(self, document, questions, model_type, progress=None):
+        """Ground several questions on one document.
+
+        OCR, the region indexes and the LLM context are built once and shared, answers are
+        generated in LLM batches, and all (question, region) pairs are scored in one batched pass.
+        Returns one dict per question with the answer, block/line/word/point boxes, page and
+        the pages of the regions retrieved as its LLM context ('context_pages').
+        """
+        document_type = document.document_type
+        line_index, block_index, gap = self.document_indexes(document, progress)
+
+        curr_time = time()
+        _report(progress, "llm")
+        if model_type == "Drishtikon" or document_type=="pdf":
+            predicted_answers, context_ids = self.generate_answers(questions, block_index, gap)
+        elif model_type == "Param":
+            predicted_answers = [generate_via_inhouse_model_answer(question, document.path) for question in questions]
+            context_ids = [[] for _ in questions]
+        print(f"Done with LLM for {len(questions)} questions in {time() - curr_time} seconds")
+
+        curr_time = time()
+        _report(progress, "matching")
+        pairs = list(zip(questions, predicted_answers))
+        line_matches = match_region_ids_batch(pairs, line_index, MAX_LINE_MATCHES)
+        if block_index is line_index:
+            # Same regions: re-rank the line scores instead of scoring again (with pruning, every region
+            # that could enter the line top-k was scored, so the smaller block top-k is exact too)
+            block_matches = [(rank_matches(scores, MAX_BLOCK_MATCHES), scores) for _, scores in line_matches]
+        else:
+            block_matches = match_region_ids_batch(pairs, block_index, MAX_BLOCK_MATCHES)
+        print(f"Done with match for {len(questions)} questions in {time() - curr_time} seconds")
+
+        results = []
+        for question, predicted_answer, region_ids, (line_ids, _), (block_ids, _) in zip(
+                questions, predicted_answers, context_ids, line_matches, block_matches):
+            answer_line_index, line_ids, answer_block_index, block_ids = self.candidate_page_matches(
+                question, predicted_answer, document, line_index, line_ids, block_index, block_ids)
+            answer, block_bboxes, line_bboxes, word_bboxes, point_bboxes, current_page = ground_answer(
+                predicted_answer, answer_line_index, line_ids, answer_block_index, block_ids, document_type)
+            results.append({
+                'question': question,
+                'answer': answer,
+                'block_bboxes': block_bboxes,
+                'line_bboxes': line_bboxes,
+                'word_bboxes': word_bboxes,
+                'point_bboxes': point_bboxes,
+                'current_page': current_page,
+                'context_pages': sorted({int(block_index.pages[region_id]) for region_id in region_ids})
+            })
+        return results
@@ -0,0 +1,236 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+
+# Address of the grounding server
+GROUNDING_HOST = os.environ.get("DRISHTIKON_GROUNDING_HOST", "127.0.0.1")
+GROUNDING_PORT = int(os.environ.get("DRISHTIKON_GROUNDING_PORT", "8600"))
+# Largest document accepted by the server, in MB
+MAX_DOCUMENT_MB = int(os.environ.get("DRISHTIKON_MAX_DOCUMENT_MB", "64"))
+# Uploaded documents the server keeps (least recently used are deleted; clients re-upload on 404)
+MAX_SERVER_DOCUMENTS = int(os.environ.get("DRISHTIKON_GROUNDING_MAX_DOCUMENTS", "64"))
+# Where the server stores uploads; kept apart from the app's session workspaces and their stale cleanup
+GROUNDING_WORKSPACE_DIR = os.environ.get("DRISHTIKON_GROUNDING_WORKSPACE_DIR",
+                                         os.path.join(tempfile.gettempdir(), "drishtikon-grounding-server"))
+
+logger = logging.getLogger(__name__)
+
+_suffixes = {"pdf": ".pdf", "image": ".png"}
+# base64 in a JSON request is ~4/3 of the document size
+_max_body_bytes = MAX_DOCUMENT_MB * 2**20 * 2
+
+
+def _json_default(value):
+    # numpy scalars / arrays in the grounding results
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class GroundingRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of a GroundingEngine (see `serve`).
+
+    GET  /health                      -> {"status": "ok", "models": [loaded model names]}
+    POST /documents?type=pdf|image    raw document bytes -> {"document_id"}; with &prepare=1 its OCR,
+                                      layout and indexing start in the background right away
+    POST /ground                      {"document_id" or "document" (base64) + "document_type",
+                                       "questions": [...], "model_type"} -> {"results": [...]}
+
+    Each result has the answer, block/line/word/point boxes and page ('current_page', -1
+    for images), as returned by GroundingEngine.ground_batch.
+    """
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, default=_json_default, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length > _max_body_bytes:
+            raise ValueError("Request too large")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "models": self.server.engine.models.loaded()})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        try:
+            if path == "/documents":
+                params = dict(item.partition("=")[::2] for item in query.split("&") if item)
+                document = self.server.add_document(self._read_body(), params.get("type", "pdf"))
+                if params.get("prepare") == "1":
+                    self.server.prepare_document(document)
+                self._send_json(200, {"document_id": document.digest})
+            elif path == "/ground":
+                self._ground(json.loads(self._read_body()))
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            logger.exception("Request %s failed", self.path)
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _ground(self, request):
+        if "document" in request:
+            document = self.server.add_document(base64.b64decode(request["document"]), request.get("document_type", "pdf"))
+        else:
+            document = self.server.get_document(request["document_id"])
+            if document is None:
+                self._send_json(404, {"error": "Unknown document_id; upload the document first"})
+                return
+        questions = request.get("questions") or [request["question"]]
+        results = self.server.engine.ground_batch(document, questions, request.get("model_type", "Drishtikon"))
+        self._send_json(200, {"document_id": document.digest, "results": results})
+
+
+class GroundingServer(ThreadingHTTPServer):
+    """HTTP server sharing one GroundingEngine (and its warm models) between all clients.
+
+    Uploads are kept in `workspace`, at most `max_documents` of them (least recently used
+    first out).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, engine, workspace, max_documents=MAX_SERVER_DOCUMENTS):
+        super().__init__(address, GroundingRequestHandler)
+        self.engine = engine
+        self.workspace = workspace
+        self.max_documents = max_documents
+        self.documents = OrderedDict()
+        self._documents_lock = threading.Lock()
+        self._preparing = set()
+        self._preparing_lock = threading.Lock()
+
+    def add_document(self, data, document_type):
+        if document_type not in _suffixes:
+            raise ValueError(f"Unknown document type '{document_type}'")
+        if len(data) > MAX_DOCUMENT_MB * 2**20:
+            raise ValueError(f"Document larger than {MAX_DOCUMENT_MB} MB")
+        with self._documents_lock:
+            document = self.workspace.add_document(data, document_type, _suffixes[document_type])
+            self.documents[document.digest] = document
+            self.documents.move_to_end(document.digest)
+            while len(self.documents) > self.max_documents:
+                _, evicted = self.documents.popitem(last=False)
+                self.workspace.remove_document(evicted)
+        return document
+
+    def get_document(self, digest):
+        """The stored DocumentHandle with this digest, or None if unknown or its file is gone."""
+        with self._documents_lock:
+            document = self.documents.get(digest)
+            if document is None:
+                return None
+            if not os.path.exists(document.path):
+                del self.documents[digest]
+                return None
+            self.documents.move_to_end(digest)
+            self.workspace.touch()
+            return document
+
+    def prepare_document(self, document):
+        """Warm the engine's caches for a document in a background thread (once at a time per document)."""
+        with self._preparing_lock:
+            if document.digest in self._preparing:
+                return
+            self._preparing.add(document.digest)
+
+        def run():
+            try:
+                self.engine.prepare(document)
+            finally:
+                with self._preparing_lock:
+                    self._preparing.discard(document.digest)
+        threading.Thread(target=run, daemon=True).start()
+
+
+def serve(host=GROUNDING_HOST, port=GROUNDING_PORT, engine=None):
+    """Run the grounding server until interrupted; models are loaded on the first request that needs them."""
+    from grounding import GroundingEngine
+    from workspace import Workspace
+
+    server = GroundingServer((host, port), engine if engine is not None else GroundingEngine(),
+                             Workspace(root=GROUNDING_WORKSPACE_DIR, session_id="grounding-server"))
+    print(f"Grounding server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.workspace.cleanup()
+
+
+class GroundingClient:
+    """Client of a grounding server; documents are uploaded once and then referenced by digest."""
+
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def health(self):
+        response = requests.get(f"{self.url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def upload(self, data, document_type, prepare=False):
+        params = {"type": document_type}
+        if prepare:
+            params["prepare"] = "1"
+        response = requests.post(f"{self.url}/documents", params=params, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["document_id"]
+
+    def ground(self, document_id, questions, model_type="Drishtikon"):
+        request = {"document_id": document_id, "questions": list(questions), "model_type": model_type}
+        response = requests.post(f"{self.url}/ground", json=request, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["results"]
+
+    def prepare_document(self, document):
+        """Upload a DocumentHandle and have the server start its OCR at once (speculative prefetch)."""
+        with open(document.path, 'rb') as f:
+            return self.upload(f.read(), document.document_type, prepare=True)
+
+    def ground_document(self, document, questions, model_type="Drishtikon"):
+        """Ground questions on a DocumentHandle, uploading it only if the server does not have it yet."""
+        # the server, like the workspaces, addresses documents by the SHA-256 of their bytes
+        try:
+            return self.ground(document.digest, questions, model_type)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+        with open(document.path, 'rb') as f:
+            self.upload(f.read(), document.document_type)
+        return self.ground(document.digest, questions, model_type)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the DrishtiKon grounding engine over HTTP/JSON.")
+    parser.add_argument("--host", default=GROUNDING_HOST)
+    parser.add_argument("--port", type=int, default=GROUNDING_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.host, args.port)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Threads running jobs of a JobQueue
+JOB_WORKERS = int(os.environ.get("DRISHTIKON_JOB_WORKERS", "2"))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = int(os.environ.get("DRISHTIKON_JOB_TTL", "3600"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job:
+    """State of one submitted job, updated by the worker running it.
+
+    `stage` is the last progress stage reported by the job (e.g. "ocr", "llm"), `stages` the
+    history of (stage, seconds since submission). `partial` is the last intermediate result of a
+    streaming job. `result` / `error` are set when it finishes.
+    """
+
+    def __init__(self, job_id, name, key=None):
+        self.id = job_id
+        self.name = name
+        self.key = key
+        self.status = JOB_QUEUED
+        self.stage = None
+        self.stages = []
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def set_stage(self, stage):
+        """Progress callback handed to the job function."""
+        self.stage = stage
+        self.stages.append((stage, round(time.time() - self.created, 2)))
+
+    def set_partial(self, partial):
+        """Intermediate result callback handed to streaming jobs."""
+        self.partial = partial
+
+
+class JobQueue:
+    """Local job queue with a pool of worker threads.
+
+    `submit(name, fn, ...)` runs `fn(*args, progress=job.set_stage, **kwargs)` on a worker and
+    returns the job id at once; `get(job_id)` returns the Job to poll its status, stage and
+    result. With `stream=True`, `fn` also gets `on_partial=job.set_partial` to publish
+    intermediate results while it runs. Jobs submitted with a `key` (e.g. a document digest) are deduplicated: while one is
+    queued or running, submitting the same key returns its id instead of starting another.
+    Finished jobs are dropped `ttl` seconds after they end.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drishtikon-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, key=None, stream=False, **kwargs):
+        with self._lock:
+            self._prune()
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and not job.done:
+                        return job.id
+            job = Job(uuid.uuid4().hex, name, key)
+            self._jobs[job.id] = job
+        if stream:
+            kwargs = dict(kwargs, on_partial=job.set_partial)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        """The Job with this id, or None if unknown or already pruned."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = JOB_RUNNING
+        try:
+            job.result = fn(*args, progress=job.set_stage, **kwargs)
+            status = JOB_DONE
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            status = JOB_FAILED
+        # `finished` first: a poller seeing the job done always finds its end time
+        job.finished = time.time()
+        job.status = status
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished > self.ttl]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,373 @@
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Indel, Levenshtein
+
+from region_index import NGRAM_SIZE, as_region_index, process_for_token_set
+
+
+CUT_OFF_THRESHOLD = 70
+QUESTION_WEIGHT = 0.2
+ANSWER_WEIGHT = 0.8
+
+# Number of worker threads used by rapidfuzz's cdist (-1 = all cores)
+SCORER_WORKERS = -1
+
+# Candidate pruning modes
+PRUNING_OFF = "off"                  # fuzzy-score every region
+PRUNING_EXACT = "exact"              # score the candidates, then every other region whose upper bound could still reach the top-k
+PRUNING_APPROXIMATE = "approximate"  # score the candidates only
+# Maximum number of candidates taken from the inverted index; smaller documents are always fully scanned
+CANDIDATE_LIMIT = 200
+
+stop_words = {'what', 'is', 'the', 'this', 'that', 'these', 'those', 'which', 'how', 'why', 'where', 'when', 'who', 'will', 'be', 'and', 'or', 'in', 'at', 'to', 'for', 'of', 'with', 'by'}
+
+
+def get_question_terms(question_text):
+    return [word.lower() for word in question_text.split() if word.lower() not in stop_words]
+
+
+def partial_ratio(s1, s2, **kwargs):
+    """fuzzywuzzy's partial_ratio (python-Levenshtein backend), built on rapidfuzz primitives.
+
+    rapidfuzz's own partial_ratio searches the optimal alignment and scores noisy OCR text
+    higher. This keeps the original heuristic, windows of the longer string anchored on the
+    matching blocks of one Levenshtein alignment, so scores and rankings stay as they were.
+    """
+    if s1 == s2:
+        return 100
+    if not s1 or not s2:
+        return 0
+    shorter, longer = (s1, s2) if len(s1) <= len(s2) else (s2, s1)
+    best = 0.0
+    for block in Levenshtein.opcodes(shorter, longer).as_matching_blocks():
+        long_start = max(block.b - block.a, 0)
+        r = Indel.normalized_similarity(shorter, longer[long_start:long_start + len(shorter)])
+        if r > .995:
+            return 100
+        best = max(best, r)
+    return int(round(100 * best))
+
+
+def score_matrix(queries, choices, scorer):
+    """Score every query against every choice in one cdist call.
+
+    Returns an int matrix of shape (len(queries), len(choices)), rounded like fuzzywuzzy scores.
+    """
+    if not queries or not choices:
+        return np.zeros((len(queries), len(choices)), dtype=np.int64)
+    scores = process.cdist(queries, choices, scorer=scorer, dtype=np.float64, workers=SCORER_WORKERS)
+    return np.rint(scores).astype(np.int64)
+
+
+def combine_scores(partial_score, token_score, best_partial_question, best_token_question, region_len, target_len):
+    """Combine the fuzzy scores of the answer and question terms into answer/question/combined scores.
+
+    The combination is non-decreasing in every fuzzy score, so feeding it upper bounds
+    gives an upper bound on the combined score.
+    """
+    # Calculate length factor (preference for longer matches that contain meaningful content)
+    length_factor = np.minimum(1.0, region_len / max(min(50, target_len), 1))
+
+    # Higher weight to token matching for longer texts, higher weight to partial matching for shorter texts
+    long_answer_score = (partial_score * 0.3) + (token_score * 0.5) + (length_factor * 100 * 0.2)
+    short_answer_score = (partial_score * 0.3) + (token_score * 0.4) + (length_factor * 100 * 0.3)
+    # Penalize very short inexact matches
+    short_answer_score = np.where((region_len < 5) & (partial_score < 100), short_answer_score * 0.5, short_answer_score)
+    answer_score = np.where(region_len > 10, long_answer_score, short_answer_score)
+
+    # penalize shorter region_texts
+    answer_score = np.where(region_len < 5, answer_score * 0.5, answer_score)
+
+    question_score = (best_partial_question * 0.4) + (best_token_question * 0.6)
+
+    combined_score = (answer_score * ANSWER_WEIGHT) + (question_score * QUESTION_WEIGHT)
+    return answer_score, question_score, combined_score
+
+
+def score_regions_batch(question_answer_pairs, index, region_ids=None):
+    """Compute answer, question and combined scores for several (question, answer) pairs at once.
+
+    The answers and question terms of all pairs are de-duplicated and scored against the
+    regions in a single cdist pass per scorer. Scores all regions, or only `region_ids` when given.
+    Returns one dict of numpy arrays per pair, aligned with the scored regions.
+    """
+    if region_ids is None:
+        lower_texts, token_texts = index.lower_texts, index.token_texts
+        region_len = index.lengths.astype(float)
+    else:
+        lower_texts = [index.lower_texts[region_id] for region_id in region_ids]
+        token_texts = [index.token_texts[region_id] for region_id in region_ids]
+        region_len = index.lengths[region_ids].astype(float)
+
+    queries = []
+    query_rows = {}
+
+    def query_row(query):
+        if query not in query_rows:
+            query_rows[query] = len(queries)
+            queries.append(query)
+        return query_rows[query]
+
+    pair_rows = []
+    for question_text, target_text in question_answer_pairs:
+        pair_rows.append((query_row(target_text.lower()), [query_row(term) for term in get_question_terms(question_text)]))
+
+    partial_scores = score_matrix(queries, lower_texts, partial_ratio).astype(float)
+    token_scores = score_matrix([process_for_token_set(query) for query in queries], token_texts, fuzz.token_set_ratio).astype(float)
+
+    results = []
+    for (question_text, target_text), (answer_row, term_rows) in zip(question_answer_pairs, pair_rows):
+        # Best scores for question terms
+        if term_rows:
+            best_partial_question = partial_scores[term_rows].max(axis=0)
+            best_token_question = token_scores[term_rows].max(axis=0)
+        else:
+            best_partial_question = np.zeros(len(lower_texts))
+            best_token_question = np.zeros(len(lower_texts))
+
+        answer_score, question_score, combined_score = combine_scores(
+            partial_scores[answer_row], token_scores[answer_row],
+            best_partial_question, best_token_question, region_len, len(target_text))
+
+        target_lower = queries[answer_row]
+        results.append({
+            'exact': np.array([target_lower in text for text in lower_texts], dtype=bool),
+            'answer_score': answer_score,
+            'question_score': question_score,
+            'combined_score': combined_score,
+        })
+    return results
+
+
+def score_regions(question_text, target_text, index, region_ids=None):
+    """Compute answer, question and combined scores for regions of a RegionIndex at once.
+
+    Scores all regions, or only `region_ids` when given.
+    Returns a dict of numpy arrays aligned with the scored regions.
+    """
+    return score_regions_batch([(question_text, target_text)], index, region_ids)[0]
+
+
+def partial_ratio_bound(index, lookup):
+    """Upper bound on partial_ratio(query, region) for every region, from n-gram hits alone.
+
+    q-gram lemma: an alignment with e insertions/deletions destroys at most NGRAM_SIZE * e
+    n-grams of the shorter string, and every n-gram that survives is shared with the other string.
+    """
+    query_len = lookup['length']
+    shorter_len = np.minimum(query_len, index.lower_lengths)
+    # the aligned window is at most as long as the shorter string
+    max_edits = 2 * NGRAM_SIZE * np.maximum(shorter_len, 1)
+    missing = np.maximum(lookup['clean_ngram_count'] - lookup['clean_hits'], 0)
+    query_bound = 1 - missing / max_edits
+    # when the region is the shorter string we only know its n-grams are all missing if nothing was hit
+    region_bound = np.where(lookup['clean_hits'] == 0, 1 - index.clean_ngram_counts / max_edits, 1.0)
+    bound = np.where(query_len <= index.lower_lengths, query_bound, region_bound)
+    return np.where(shorter_len == 0, 0.0, 100 * bound)
+
+
+def token_set_ratio_bound(index, lookup):
+    """Upper bound on token_set_ratio(query, region) for every region, from token and n-gram hits alone.
+
+    Without a shared token the score is the Indel ratio of the two sorted token strings,
+    which is bounded by their lengths and by the q-gram lemma.
+    """
+    query_len = lookup['token_set_length']
+    region_len = index.token_set_lengths
+    total_len = np.maximum(query_len + region_len, 1)
+    length_bound = 2 * np.minimum(query_len, region_len) / total_len
+    missing = np.maximum(lookup['token_set_ngram_count'] - lookup['token_set_hits'], 0)
+    ngram_bound = 1 - missing / (NGRAM_SIZE * total_len)
+    bound = np.where(lookup['shares_token'], 1.0, np.minimum(length_bound, ngram_bound))
+    return np.where((query_len == 0) | (region_len == 0), 0.0, 100 * bound)
+
+
+def upper_bound_scores(index, target_text, lookups):
+    """Upper bound on combined_score for every region; `lookups` are for the answer then each question term."""
+    def rounded(bound):
+        # fuzzy scores are rounded to ints, allow for float error in the bound
+        return np.ceil(bound - 1e-9)
+
+    partial_bound = rounded(partial_ratio_bound(index, lookups[0]))
+    token_bound = rounded(token_set_ratio_bound(index, lookups[0]))
+    if len(lookups) > 1:
+        best_partial_question = np.max([rounded(partial_ratio_bound(index, lookup)) for lookup in lookups[1:]], axis=0)
+        best_token_question = np.max([rounded(token_set_ratio_bound(index, lookup)) for lookup in lookups[1:]], axis=0)
+    else:
+        best_partial_question = np.zeros(len(index))
+        best_token_question = np.zeros(len(index))
+
+    _, _, combined_bound = combine_scores(
+        partial_bound, token_bound, best_partial_question, best_token_question,
+        index.lengths.astype(float), len(target_text))
+    return combined_bound
+
+
+def build_match(region, scores, region_id):
+    """Copy a region and attach its match_score / match_details."""
+    region_copy = region.copy()
+    if scores['exact'][region_id]:
+        region_copy['match_score'] = 100
+        region_copy['match_details'] = {
+                'exact_match': True,
+                'answer_score': 100,
+                'question_score': 100
+            }
+    else:
+        region_copy['match_score'] = float(scores['combined_score'][region_id])
+        region_copy['match_details'] = {
+            'exact_match': False,
+            'answer_score': float(scores['answer_score'][region_id]),
+            'question_score': float(scores['question_score'][region_id]),
+            'answer_weight': ANSWER_WEIGHT,
+            'question_weight': QUESTION_WEIGHT
+        }
+    return region_copy
+
+
+def rank_matches(scores, max_matches):
+    """Return ids of the top regions above CUT_OFF_THRESHOLD, best first.
+
+    Ties keep their original order, as with the stable list sort used before.
+    """
+    match_score = np.where(scores['exact'], 100.0, scores['combined_score'])
+    region_ids = np.flatnonzero(match_score >= CUT_OFF_THRESHOLD)
+    order = np.argsort(-match_score[region_ids], kind='stable')
+    return region_ids[order][:max_matches]
+
+
+def _fill_scores(scores, region_ids, region_scores):
+    for key, values in region_scores.items():
+        scores[key][region_ids] = values
+    scores['scored'][region_ids] = True
+
+
+def match_region_ids(question_text, target_text, index, max_matches, pruning=PRUNING_EXACT):
+    """Return (region ids of the top matches, scores) for a RegionIndex.
+
+    With pruning, only regions that share a token or n-gram with the answer or a question
+    term are fuzzy-scored (at most CANDIDATE_LIMIT of them, most evidence first).
+    In PRUNING_EXACT mode every other region whose score upper bound could still reach the
+    top-k above CUT_OFF_THRESHOLD is scored too, so the result is the same as a full scan;
+    when nothing can be ruled out this falls back to scoring every region.
+    """
+    if pruning == PRUNING_OFF or len(index) <= CANDIDATE_LIMIT:
+        scores = score_regions(question_text, target_text, index)
+        scores['scored'] = np.ones(len(index), dtype=bool)
+        return rank_matches(scores, max_matches), scores
+
+    target_lower = target_text.lower()
+    lookups = [index.lookup(query) for query in [target_lower] + get_question_terms(question_text)]
+
+    evidence = np.zeros(len(index), dtype=np.int64)
+    for lookup in lookups:
+        evidence += lookup['clean_hits'] + lookup['token_set_hits'] + lookup['shares_token']
+    exact = np.array([target_lower in text for text in index.lower_texts], dtype=bool)
+    ranked_by_evidence = np.argsort(-evidence, kind='stable')
+    candidates = ranked_by_evidence[:CANDIDATE_LIMIT]
+    candidates = np.union1d(candidates[evidence[candidates] > 0], np.flatnonzero(exact))
+
+    scores = {
+        'exact': exact,
+        'answer_score': np.full(len(index), np.nan),
+        'question_score': np.full(len(index), np.nan),
+        'combined_score': np.full(len(index), -np.inf),
+        'scored': np.zeros(len(index), dtype=bool),
+    }
+    _fill_scores(scores, candidates, score_regions(question_text, target_text, index, candidates))
+
+    if pruning == PRUNING_EXACT:
+        region_ids = rank_matches(scores, max_matches)
+        if len(region_ids) < max_matches:
+            needed = CUT_OFF_THRESHOLD
+        else:
+            last = region_ids[-1]
+            needed = 100 if exact[last] else scores['combined_score'][last]
+        bounds = upper_bound_scores(index, target_text, lookups)
+        remaining = np.flatnonzero(~scores['scored'] & (bounds >= needed))
+        if len(remaining):
+            _fill_scores(scores, remaining, score_regions(question_text, target_text, index, remaining))
+
+    return rank_matches(scores, max_matches), scores
+
+
+def get_matched_regions(question_text, target_text, predictions, max_matches, pruning=PRUNING_EXACT):
+    """Score all regions in one batch and return the top `max_matches` copies with match details.
+
+    `predictions` is a RegionIndex, or a list of region dicts which is indexed on the fly.
+    """
+    index = as_region_index(predictions)
+    region_ids, scores = match_region_ids(question_text, target_text, index, max_matches, pruning)
+    return [build_match(index.regions[region_id], scores, region_id) for region_id in region_ids]
+
+
+def match_region_ids_batch(question_answer_pairs, index, max_matches, pruning=PRUNING_EXACT):
+    """Top-match region ids for several (question, answer) pairs on one document.
+
+    On documents of at most CANDIDATE_LIMIT regions (or with PRUNING_OFF) all (question, region)
+    pairs are scored in one batched pass over the whole index. On larger documents each pair
+    goes through `match_region_ids` with the same candidate pruning as a single question, which
+    scores far fewer regions than a shared full scan.
+    Returns a list of (region ids, scores), one per pair.
+    """
+    if pruning != PRUNING_OFF and len(index) > CANDIDATE_LIMIT:
+        return [match_region_ids(question_text, target_text, index, max_matches, pruning)
+                for question_text, target_text in question_answer_pairs]
+    results = []
+    for scores in score_regions_batch(question_answer_pairs, index):
+        scores['scored'] = np.ones(len(index), dtype=bool)
+        results.append((rank_matches(scores, max_matches), scores))
+    return results
+
+
+def get_matched_regions_batch(question_answer_pairs, predictions, max_matches, pruning=PRUNING_EXACT):
+    """Batched get_matched_regions: one list of match copies per (question, answer) pair."""
+    index = as_region_index(predictions)
+    return [
+        [build_match(index.regions[region_id], scores, region_id) for region_id in region_ids]
+        for region_ids, scores in match_region_ids_batch(question_answer_pairs, index, max_matches, pruning)
+    ]
+
+
+def longest_consecutive_range(indices):
+    if not indices:
+        return []
+
+    indices = sorted(set(indices))
+    longest = []
+    current = [indices[0]]
+
+    for i in range(1, len(indices)):
+        if indices[i] == indices[i - 1] + 1:
+            current.append(indices[i])
+        else:
+            if len(current) > len(longest):
+                longest = current
+            current = [indices[i]]
+
+    if len(current) > len(longest):
+        longest = current
+
+    return longest
+
+
+def get_word_level_matches(answer_text, index, region_ids):
+    """Word boxes of the longest run of answer words inside each matched region."""
+    answer_lower = answer_text.lower()
+    bboxes = []
+    for region_id in region_ids:
+        indices = [i for i, word in enumerate(index.word_texts[region_id]) if word in answer_lower]
+        words = index.regions[region_id]['words']
+        for i in longest_consecutive_range(indices):
+            bboxes.append(words[i]['bbox'])
+    return bboxes
+
+
+def get_page_number(index, region_ids):
+    """Page holding most of the matched regions; ties go to the best ranked page."""
+    pages = index.pages[np.asarray(region_ids, dtype=np.int64)]
+    if len(pages) == 0:
+        return 0
+    page_ids, first_seen, counts = np.unique(pages, return_index=True, return_counts=True)
+    best = np.flatnonzero(counts == counts.max())
+    return int(page_ids[best[np.argmin(first_seen[best])]])
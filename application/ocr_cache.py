@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DRISHTIKON_OCR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "drishtikon", "ocr")
+)
+DEFAULT_MAX_BYTES = int(os.environ.get("DRISHTIKON_OCR_CACHE_MB", "2048")) * 1024 * 1024
+
+# Model settings that change the OCR / layout output; part of every cache key
+DOCTR_CONFIG = {"det_arch": "db_resnet50", "reco_arch": "crnn_vgg16_bn", "pretrained": True}
+LAYOUT_CONFIG = {"layout": "surya.layout.LayoutPredictor", **DOCTR_CONFIG}
+# Blocks whose text is assigned from the line OCR instead of re-OCRing each crop
+BLOCK_LINES_CONFIG = {**LAYOUT_CONFIG, "block_text": "lines"}
+
+
+def image_digest(image):
+    """SHA-256 of the decoded pixels of a PIL image or numpy array (independent of file encoding)."""
+    array = np.ascontiguousarray(np.asarray(image))
+    digest = hashlib.sha256()
+    digest.update(f"{array.shape}|{array.dtype}|".encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def cache_key(image, kind, config):
+    """Content address of one page: pixel hash + kind of prediction + model config."""
+    settings = json.dumps({"kind": kind, "config": config}, sort_keys=True)
+    return hashlib.sha256(f"{image_digest(image)}|{settings}".encode()).hexdigest()
+
+
+class OCRCache:
+    """Persistent on-disk cache of per-page OCR / layout predictions.
+
+    Entries are JSON files addressed by `cache_key`, so the same page is recognised across
+    uploads, restarts, the Streamlit app and the batch scripts. Reads refresh an entry's mtime
+    and the least recently used entries are evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename so concurrent readers never see partial entries
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f, ensure_ascii=False)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+
+        if self._size is None:
+            self._size = self._entries_size()
+        else:
+            self._size += size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def get_or_compute(self, image, kind, config, compute):
+        """Return the cached value for this page, or run `compute()` and store its result."""
+        key = cache_key(image, kind, config)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _entries_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in `max_bytes`."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
@@ -0,0 +1,257 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from record_log import read_record_log
+
+
+STORE_VERSION = 2
+# Region 'page' value for records that have none
+NO_PAGE = -1
+
+_ARRAYS = ('region_boxes', 'region_int_boxes', 'region_pages', 'region_has_words', 'region_text_offsets', 'region_word_offsets',
+           'word_boxes', 'word_text_offsets')
+# Region / word links of extract_regions (line 'block', block 'lines', block word 'line'); since version 2
+_LINK_ARRAYS = ('region_has_block', 'region_block', 'region_has_lines', 'region_line_offsets', 'region_lines',
+                'word_has_line', 'word_line')
+
+
+def _concat_strings(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.cumsum([0] + [len(data) for data in encoded], dtype=np.int64)
+    return b"".join(encoded), offsets
+
+
+def write_ocr_store(path, data):
+    """Write {image_name: [region records]} as a columnar OCR store directory.
+
+    Layout of `path`:
+        index.json: format version and, per image, its [start, end) range of regions
+        region_*.npy / word_*.npy: coordinate arrays, page ids and offsets (memory-mappable)
+        region_text.bin / word_text.bin: UTF-8 string tables addressed by the offset arrays
+
+    Region records are {'bbox', 'text'} with optional 'words' ({'bbox', 'text'}, optional
+    'line'), 'page', 'block' and 'lines' (the links added by ocr_utils.link_page_regions);
+    other keys are not stored. Integer region boxes (layout blocks) are read back as ints.
+    """
+    index = {}
+    region_boxes, region_int_boxes, region_pages, region_has_words, region_texts, word_counts = [], [], [], [], [], [0]
+    word_boxes, word_texts = [], []
+    region_has_block, region_block, region_has_lines, region_line_counts, region_lines = [], [], [], [0], []
+    word_has_line, word_line = [], []
+    for image_name, predictions in data.items():
+        start = len(region_texts)
+        for region in predictions:
+            words = region.get('words')
+            region_boxes.append(region['bbox'])
+            region_int_boxes.append(all(isinstance(x, int) for x in region['bbox']))
+            region_pages.append(region.get('page', NO_PAGE))
+            region_has_words.append(words is not None)
+            region_texts.append(region['text'])
+            region_has_block.append('block' in region)
+            region_block.append(region.get('block', 0))
+            region_has_lines.append('lines' in region)
+            region_line_counts.append(len(region.get('lines', ())))
+            region_lines.extend(region.get('lines', ()))
+            word_counts.append(len(words or ()))
+            for word in words or ():
+                word_boxes.append(word['bbox'])
+                word_texts.append(word['text'])
+                word_has_line.append('line' in word)
+                word_line.append(word.get('line', 0))
+        index[image_name] = [start, len(region_texts)]
+
+    region_text, region_text_offsets = _concat_strings(region_texts)
+    word_text, word_text_offsets = _concat_strings(word_texts)
+    arrays = {
+        'region_boxes': np.array(region_boxes, dtype=np.float64).reshape(-1, 4),
+        'region_int_boxes': np.array(region_int_boxes, dtype=bool),
+        'region_pages': np.array(region_pages, dtype=np.int64),
+        'region_has_words': np.array(region_has_words, dtype=bool),
+        'region_text_offsets': region_text_offsets,
+        'region_word_offsets': np.cumsum(word_counts, dtype=np.int64),
+        'word_boxes': np.array(word_boxes, dtype=np.float64).reshape(-1, 4),
+        'word_text_offsets': word_text_offsets,
+        'region_has_block': np.array(region_has_block, dtype=bool),
+        'region_block': np.array(region_block, dtype=np.int64),
+        'region_has_lines': np.array(region_has_lines, dtype=bool),
+        'region_line_offsets': np.cumsum(region_line_counts, dtype=np.int64),
+        'region_lines': np.array(region_lines, dtype=np.int64),
+        'word_has_line': np.array(word_has_line, dtype=bool),
+        'word_line': np.array(word_line, dtype=np.int64),
+    }
+
+    # build next to the target and swap in, so readers never see a half-written store
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=parent, prefix=".ocr_store-")
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_dir, name + ".npy"), array)
+    with open(os.path.join(temp_dir, "region_text.bin"), 'wb') as f:
+        f.write(region_text)
+    with open(os.path.join(temp_dir, "word_text.bin"), 'wb') as f:
+        f.write(word_text)
+    with open(os.path.join(temp_dir, "index.json"), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'images': index}, f, ensure_ascii=False)
+
+    if os.path.isdir(path):
+        old_dir = tempfile.mkdtemp(dir=parent, prefix=".ocr_store-old-")
+        os.replace(path, os.path.join(old_dir, "store"))
+        os.replace(temp_dir, path)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(temp_dir, path)
+
+
+def _map_bytes(path):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+class OCRStore:
+    """Read-only, memory-mapped view of an OCR store written by `write_ocr_store`.
+
+    Behaves like the {image_name: [region records]} dict loaded from the JSON stores:
+    `store[image_name]` decodes only that image's regions; nothing else is parsed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json"), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] not in (1, STORE_VERSION):
+            raise ValueError(f"Unsupported OCR store version {meta['version']} in {path}")
+        self.index = meta['images']
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"), mmap_mode='r'))
+        # version 1 stores have no links
+        self.has_links = meta['version'] >= 2
+        for name in _LINK_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + ".npy"), mmap_mode='r') if self.has_links else None)
+        self.region_text = _map_bytes(os.path.join(path, "region_text.bin"))
+        self.word_text = _map_bytes(os.path.join(path, "word_text.bin"))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, image_name):
+        return image_name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        for image_name in self.index:
+            yield image_name, self[image_name]
+
+    def get(self, image_name, default=None):
+        if image_name not in self.index:
+            return default
+        return self[image_name]
+
+    def __getitem__(self, image_name):
+        start, end = self.index[image_name]
+        if start == end:
+            return []
+
+        region_boxes = self.region_boxes[start:end].tolist()
+        region_int_boxes = self.region_int_boxes[start:end].tolist()
+        region_pages = self.region_pages[start:end].tolist()
+        region_has_words = self.region_has_words[start:end].tolist()
+        text_offsets = self.region_text_offsets[start:end + 1]
+        region_text = bytes(self.region_text[text_offsets[0]:text_offsets[-1]])
+        text_offsets = (text_offsets - text_offsets[0]).tolist()
+
+        word_offsets = self.region_word_offsets[start:end + 1]
+        word_start, word_end = int(word_offsets[0]), int(word_offsets[-1])
+        word_boxes = self.word_boxes[word_start:word_end].tolist()
+        word_text_offsets = self.word_text_offsets[word_start:word_end + 1]
+        word_text = bytes(self.word_text[word_text_offsets[0]:word_text_offsets[-1]])
+        word_text_offsets = (word_text_offsets - word_text_offsets[0]).tolist()
+        word_offsets = (word_offsets - word_start).tolist()
+
+        if self.has_links:
+            region_has_block = self.region_has_block[start:end].tolist()
+            region_block = self.region_block[start:end].tolist()
+            region_has_lines = self.region_has_lines[start:end].tolist()
+            line_offsets = self.region_line_offsets[start:end + 1]
+            region_lines = self.region_lines[line_offsets[0]:line_offsets[-1]].tolist()
+            line_offsets = (line_offsets - line_offsets[0]).tolist()
+            word_has_line = self.word_has_line[word_start:word_end].tolist()
+            word_line = self.word_line[word_start:word_end].tolist()
+
+        predictions = []
+        for i in range(end - start):
+            output = {}
+            output['bbox'] = [int(x) for x in region_boxes[i]] if region_int_boxes[i] else region_boxes[i]
+            output['text'] = region_text[text_offsets[i]:text_offsets[i + 1]].decode('utf-8')
+            if region_has_words[i]:
+                words_data = []
+                for j in range(word_offsets[i], word_offsets[i + 1]):
+                    word = {
+                        'bbox': word_boxes[j],
+                        'text': word_text[word_text_offsets[j]:word_text_offsets[j + 1]].decode('utf-8'),
+                    }
+                    if self.has_links and word_has_line[j]:
+                        word['line'] = word_line[j]
+                    words_data.append(word)
+                output['words'] = words_data
+            if region_pages[i] != NO_PAGE:
+                output['page'] = region_pages[i]
+            if self.has_links:
+                if region_has_block[i]:
+                    output['block'] = region_block[i]
+                if region_has_lines[i]:
+                    output['lines'] = region_lines[line_offsets[i]:line_offsets[i + 1]]
+            predictions.append(output)
+        return predictions
+
+
+def load_ocr_data(path):
+    """Open an OCR store directory, or json.load an OCR store JSON file; both index by image name."""
+    if os.path.isdir(path):
+        return OCRStore(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def import_json(json_path, store_path):
+    """Convert an OCR store JSON file into the columnar format."""
+    with open(json_path, 'r') as f:
+        write_ocr_store(store_path, json.load(f))
+
+
+def export_json(store_path, json_path, indent=4):
+    """Write a columnar OCR store back out as the JSON format."""
+    store = OCRStore(store_path)
+    with open(json_path, 'w') as f:
+        json.dump(dict(store.items()), f, indent=indent, ensure_ascii=False)
+
+
+def store_paths(json_path):
+    """Outputs of a store script writing `json_path`: the columnar store read by the grounding
+    scripts (`<output>.ocr`) and the checkpoint log a restarted run resumes from (`<output>.log.jsonl`)."""
+    base = os.path.splitext(json_path)[0]
+    return base + ".ocr", base + ".log.jsonl"
+
+
+def compact_record_log(log_path, json_path, store_path, keys=None):
+    """Compact an OCR checkpoint log (see record_log.RecordLog) into the final JSON and columnar store.
+
+    Images are written in `keys` order when given (e.g. the input annotation order), so the
+    output does not depend on how often the run was resumed. Returns the compacted dict.
+    """
+    records = read_record_log(log_path)
+    if keys is not None:
+        records = {key: records[key] for key in keys if key in records}
+    with open(json_path, 'w') as f:
+        json.dump(records, f, indent=4, ensure_ascii=False)
+    write_ocr_store(store_path, records)
+    return records
@@ -0,0 +1,421 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+from doctr.io import DocumentFile
+
+from ocr_cache import BLOCK_LINES_CONFIG, DOCTR_CONFIG, cache_key
+from rasterize import RenderedPages
+
+
+# Pages sent to the docTR predictor per call in get_paged_line_predictions
+OCR_BATCH_SIZE = int(os.environ.get("DRISHTIKON_OCR_BATCH_SIZE", "8"))
+
+# Images sent to the Surya layout predictor per call, and the most pixels (megapixels) one call may hold
+LAYOUT_BATCH_SIZE = int(os.environ.get("DRISHTIKON_LAYOUT_BATCH_SIZE", "8"))
+LAYOUT_BATCH_MAX_MEGAPIXELS = float(os.environ.get("DRISHTIKON_LAYOUT_BATCH_MAX_MP", "64"))
+
+# How block text is built: from the line OCR by overlap, or by re-OCRing every layout crop
+BLOCK_TEXT_FROM_LINES = "lines"
+BLOCK_TEXT_FROM_OCR = "ocr"
+# Minimum fraction of a word's area inside a layout block for it to belong to that block
+WORD_OVERLAP_THRESHOLD = 0.5
+# 'block' of a line none of whose words falls into a layout block
+NO_BLOCK = -1
+
+
+class PageLines:
+    """Columnar docTR lines of one page, in pixel coordinates.
+
+    Attributes:
+        line_boxes: float array (n_lines, 4)
+        word_boxes: float array (n_words, 4)
+        word_offsets: int array (n_lines + 1); the words of line i are word_offsets[i]:word_offsets[i + 1]
+        text: all word values concatenated
+        text_offsets: int array (n_words + 1); word j is text[text_offsets[j]:text_offsets[j + 1]]
+
+    Only used to convert a page's geometries in bulk: `to_dicts` then builds the line dicts
+    ({'bbox', 'text', 'words'}) that OCR caching, block linking and matching work on.
+    """
+
+    __slots__ = ('line_boxes', 'word_boxes', 'word_offsets', 'text', 'text_offsets')
+
+    def __init__(self, line_boxes, word_boxes, word_offsets, text, text_offsets):
+        self.line_boxes = line_boxes
+        self.word_boxes = word_boxes
+        self.word_offsets = word_offsets
+        self.text = text
+        self.text_offsets = text_offsets
+
+    @classmethod
+    def from_doctr_page(cls, page):
+        """Convert all line and word geometries of a docTR page with one array operation each."""
+        line_geometries = []
+        word_geometries = []
+        word_values = []
+        word_counts = [0]
+        for block in page.blocks:
+            for line in block.lines:
+                line_geometries.append(line.geometry)
+                word_counts.append(len(line.words))
+                for word in line.words:
+                    word_geometries.append(word.geometry)
+                    word_values.append(word.value)
+
+        # relative ((x1, y1), (x2, y2)) -> absolute [x1, y1, x2, y2], rounded as before
+        scale = np.array(tuple(reversed(page.dimensions)) * 2, dtype=np.float64)
+        line_boxes = np.round(np.array(line_geometries, dtype=np.float64).reshape(-1, 4) * scale, 2)
+        word_boxes = np.round(np.array(word_geometries, dtype=np.float64).reshape(-1, 4) * scale, 2)
+        word_offsets = np.cumsum(word_counts)
+        text_offsets = np.cumsum([0] + [len(value) for value in word_values])
+        return cls(line_boxes, word_boxes, word_offsets, "".join(word_values), text_offsets)
+
+    def to_dicts(self):
+        """Materialize every line as a {'bbox', 'text', 'words'} dict."""
+        line_boxes = self.line_boxes.tolist()
+        word_boxes = self.word_boxes.tolist()
+        text = self.text
+        text_offsets = self.text_offsets.tolist()
+        word_offsets = self.word_offsets.tolist()
+
+        line_predictions = []
+        for line_id, line_bbox in enumerate(line_boxes):
+            words_data = []
+            for j in range(word_offsets[line_id], word_offsets[line_id + 1]):
+                words_data.append({'bbox': word_boxes[j], 'text': text[text_offsets[j]:text_offsets[j + 1]]})
+            output = {}
+            output['bbox'] = line_bbox
+            output['text'] = " ".join(word['text'] for word in words_data)
+            output['words'] = words_data
+            line_predictions.append(output)
+        return line_predictions
+
+
+def get_page_line_predictions(page):
+    """Convert one docTR result page into line records ({'bbox', 'text', 'words'}) in pixel coordinates."""
+    return PageLines.from_doctr_page(page).to_dicts()
+
+
+def get_line_predictions(result):
+    """Convert a docTR result into line records ({'bbox', 'text', 'words'}) in pixel coordinates."""
+    line_predictions = []
+    for page in result.pages:
+        line_predictions.extend(get_page_line_predictions(page))
+    return line_predictions
+
+
+def _run_line_batch(batch, model, cache, config, page_lines):
+    result = model([page for _, page in batch])
+    for (page_number, page), result_page in zip(batch, result.pages):
+        page_lines[page_number] = get_page_line_predictions(result_page)
+        if cache is not None:
+            cache.put(cache_key(page, "doctr_lines", config), page_lines[page_number])
+
+
+def get_paged_line_predictions(pages, model, cache=None, config=None, batch_size=OCR_BATCH_SIZE, page_numbers=None):
+    """OCR in-memory pages (H x W x 3 uint8 arrays) in batches of `batch_size`.
+
+    `pages` may be any iterable, e.g. a RenderedPages still being rendered: pages are taken
+    as they arrive and each batch is OCRed as soon as it is full. With `page_numbers`, only
+    those pages are OCRed (`pages` must then be indexable). Pages found in `cache` (an
+    OCRCache, with `config` as the model config) are not re-run. Every returned line carries
+    the index of its page in `page`.
+    """
+    if page_numbers is None:
+        numbered_pages = enumerate(pages)
+    else:
+        numbered_pages = ((page_number, pages[page_number]) for page_number in page_numbers)
+
+    page_lines = {}
+    batch = []
+    for page_number, page in numbered_pages:
+        if cache is not None:
+            lines = cache.get(cache_key(page, "doctr_lines", config))
+            if lines is not None:
+                page_lines[page_number] = lines
+                continue
+        batch.append((page_number, page))
+        if len(batch) == batch_size:
+            _run_line_batch(batch, model, cache, config, page_lines)
+            batch = []
+    if batch:
+        _run_line_batch(batch, model, cache, config, page_lines)
+
+    line_predictions = []
+    for page_number in sorted(page_lines):
+        for output in page_lines[page_number]:
+            output['page'] = page_number
+            line_predictions.append(output)
+    return line_predictions
+
+
+def load_document_pages(source, document_type, output_folder=None):
+    """Decode a document (path or bytes) once into in-memory RGB page arrays.
+
+    PDFs give a RenderedPages, rasterized in the background by a process pool; images give
+    a single page. The arrays are read-only so they can be shared by OCR, layout and display.
+    Pages are written to `output_folder` as `<page>.png` only if it is given.
+    """
+    if document_type == "pdf":
+        pages = RenderedPages(source)
+    else:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with Image.open(source) as image:
+            page = np.array(image.convert("RGB"))
+        page.flags.writeable = False
+        pages = [page]
+
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+        for page_number, page in enumerate(pages):
+            Image.fromarray(page).save(os.path.join(output_folder, f"{page_number}.png"))
+    return pages
+
+
+def get_page_text(page):
+    """All word values of one docTR result page joined with spaces."""
+    text = []
+    for block in page.blocks:
+        for line in block.lines:
+            for word in line.words:
+                text.append(word.value)
+    return " ".join(text)
+
+
+def get_text(result):
+    """All word values of a docTR result joined with spaces."""
+    return " ".join(text for text in (get_page_text(page) for page in result.pages) if text)
+
+
+def get_layout_bboxes(image, layout_predictor):
+    """Integer pixel bboxes of the Surya layout blocks of one image."""
+    return get_layout_bboxes_batch([image], layout_predictor)[0]
+
+
+def get_layout_bboxes_batch(images, layout_predictor, batch_size=LAYOUT_BATCH_SIZE, max_megapixels=LAYOUT_BATCH_MAX_MEGAPIXELS):
+    """Integer pixel bboxes of the Surya layout blocks of every image, in the order of `images`.
+
+    Images are sent to the predictor in calls of at most `batch_size` images and
+    `max_megapixels` pixels (a single larger image still gets its own call).
+    """
+    layout_bboxes = []
+    batch = []
+    batch_pixels = 0
+    for image in list(images) + [None]:
+        pixels = image.width * image.height / 1e6 if image is not None else 0
+        if batch and (image is None or len(batch) == batch_size or batch_pixels + pixels > max_megapixels):
+            # layout_predictions is a list of dicts, one per image
+            for prediction in layout_predictor(batch):
+                layout_bboxes.append([[int(x) for x in block.bbox] for block in prediction.bboxes])
+            batch = []
+            batch_pixels = 0
+        if image is not None:
+            batch.append(image)
+            batch_pixels += pixels
+    return layout_bboxes
+
+
+def ocr_blocks(image, bboxes, model):
+    """OCR the crops of several blocks of one image with a single docTR call; returns one text per block.
+
+    Crops are passed to docTR as in-memory RGB arrays, so nothing is written to disk.
+    """
+    if not bboxes:
+        return []
+    crops = [np.asarray(image.crop(bbox).convert("RGB")) for bbox in bboxes]
+    result = model(crops)
+    return [get_page_text(page) for page in result.pages]
+
+
+def ocr_block(image, bbox, model):
+    """OCR one block crop with docTR and return its text."""
+    return ocr_blocks(image, [bbox], model)[0]
+
+
+def get_block_predictions(image, layout_predictor, model, block_bboxes=None):
+    """Detect layout blocks with Surya and OCR every block crop with docTR ({'bbox', 'text'} per block).
+
+    `block_bboxes` are the image's layout boxes if already predicted (see `get_layout_bboxes_batch`).
+    """
+    if block_bboxes is None:
+        block_bboxes = get_layout_bboxes(image, layout_predictor)
+    block_predictions = []
+    for bbox, text in zip(block_bboxes, ocr_blocks(image, block_bboxes, model)):
+        output = {}
+        output['bbox'] = bbox
+        output['text'] = text
+        block_predictions.append(output)
+    return block_predictions
+
+
+def _word_block_ids(block_bboxes, words, threshold=WORD_OVERLAP_THRESHOLD):
+    """Index of the layout block covering most of each word (NO_BLOCK if below `threshold`)."""
+    if not words or not block_bboxes:
+        return np.full(len(words), NO_BLOCK, dtype=np.int64)
+
+    word_boxes = np.array([word['bbox'] for word in words], dtype=np.float64)
+    block_boxes = np.array(block_bboxes, dtype=np.float64)
+
+    # (n_words, n_blocks) intersection areas
+    width = np.minimum(word_boxes[:, None, 2], block_boxes[None, :, 2]) - np.maximum(word_boxes[:, None, 0], block_boxes[None, :, 0])
+    height = np.minimum(word_boxes[:, None, 3], block_boxes[None, :, 3]) - np.maximum(word_boxes[:, None, 1], block_boxes[None, :, 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area = (word_boxes[:, 2] - word_boxes[:, 0]) * (word_boxes[:, 3] - word_boxes[:, 1])
+    overlap = intersection / np.maximum(area, 1e-9)[:, None]
+
+    best = overlap.argmax(axis=1)
+    assigned = overlap[np.arange(len(words)), best] >= threshold
+    return np.where(assigned, best, NO_BLOCK)
+
+
+def assign_words_to_blocks(block_bboxes, line_predictions, threshold=WORD_OVERLAP_THRESHOLD):
+    """Map every OCR word to the layout block that covers most of it.
+
+    A word is assigned to the block with the largest intersection / word area, if that
+    fraction is at least `threshold`. Returns one list of word dicts per block, in the
+    reading order of `line_predictions`.
+    """
+    words = [word for line in line_predictions for word in line['words']]
+    block_words = [[] for _ in block_bboxes]
+    for word, block_id in zip(words, _word_block_ids(block_bboxes, words, threshold).tolist()):
+        if block_id != NO_BLOCK:
+            block_words[block_id].append(dict(word))
+    return block_words
+
+
+def get_block_predictions_from_lines(image, layout_predictor, line_predictions, model=None, reocr_empty=False, block_bboxes=None):
+    """Build block records ({'bbox', 'text', 'words'}) from the page's line OCR, without a second OCR pass.
+
+    Words of `line_predictions` (pixel coordinates of the same image) are assigned to the Surya
+    layout blocks by overlap. Blocks that receive no word have empty text, unless `reocr_empty`
+    is set, in which case their crop is OCRed with `model` as before. `block_bboxes` are the
+    image's layout boxes if already predicted (see `get_layout_bboxes_batch`).
+    """
+    if block_bboxes is None:
+        block_bboxes = get_layout_bboxes(image, layout_predictor)
+    block_words = assign_words_to_blocks(block_bboxes, line_predictions)
+
+    # all empty blocks of the page are re-OCRed in one docTR call
+    reocr_texts = {}
+    if reocr_empty:
+        empty_ids = [block_id for block_id, words in enumerate(block_words) if not words]
+        reocr_texts = dict(zip(empty_ids, ocr_blocks(image, [block_bboxes[block_id] for block_id in empty_ids], model)))
+
+    block_predictions = []
+    for block_id, (bbox, words) in enumerate(zip(block_bboxes, block_words)):
+        output = {}
+        output['bbox'] = bbox
+        if block_id in reocr_texts:
+            output['text'] = reocr_texts[block_id]
+        else:
+            output['text'] = " ".join(word['text'] for word in words)
+        output['words'] = words
+        block_predictions.append(output)
+    return block_predictions
+
+
+def get_batched_block_predictions(images, layout_predictor, build_blocks, cache=None, config=None,
+                                  batch_size=LAYOUT_BATCH_SIZE, max_megapixels=LAYOUT_BATCH_MAX_MEGAPIXELS):
+    """Block records of many images (pages of a document or dataset images) with batched layout calls.
+
+    Images found in `cache` (an OCRCache, "layout_blocks" entries under `config`) are skipped;
+    the others go through `get_layout_bboxes_batch`, and `build_blocks(index, image, block_bboxes)`
+    turns the layout boxes of image `index` into its block records, which are cached. Returns
+    one list of block records per image, in the order of `images`.
+    """
+    images = list(images)
+    block_predictions = [None] * len(images)
+    missing = []
+    for index, image in enumerate(images):
+        if cache is not None:
+            block_predictions[index] = cache.get(cache_key(image, "layout_blocks", config))
+        if block_predictions[index] is None:
+            missing.append(index)
+
+    layout_bboxes = get_layout_bboxes_batch([images[index] for index in missing], layout_predictor, batch_size, max_megapixels)
+    for index, block_bboxes in zip(missing, layout_bboxes):
+        block_predictions[index] = build_blocks(index, images[index], block_bboxes)
+        if cache is not None:
+            cache.put(cache_key(images[index], "layout_blocks", config), block_predictions[index])
+    return block_predictions
+
+
+def link_page_regions(line_predictions, block_predictions, threshold=WORD_OVERLAP_THRESHOLD):
+    """Add the line / word / block relations of one page to its line and block records, in place.
+
+    Every line gets 'block': the block holding most of its words (NO_BLOCK if none). Every
+    block gets 'lines': the ids of the lines its words come from, and its 'words' are the
+    words assigned to it by overlap, each with the 'line' it belongs to. Ids are list
+    positions in `line_predictions` / `block_predictions`.
+    """
+    words = [word for line in line_predictions for word in line['words']]
+    word_line_ids = [line_id for line_id, line in enumerate(line_predictions) for _ in line['words']]
+    word_block_ids = _word_block_ids([block['bbox'] for block in block_predictions], words, threshold).tolist()
+
+    block_words = [[] for _ in block_predictions]
+    line_block_counts = [{} for _ in line_predictions]
+    for word, line_id, block_id in zip(words, word_line_ids, word_block_ids):
+        if block_id == NO_BLOCK:
+            continue
+        block_words[block_id].append({**word, 'line': line_id})
+        line_block_counts[line_id][block_id] = line_block_counts[line_id].get(block_id, 0) + 1
+
+    for line, counts in zip(line_predictions, line_block_counts):
+        # ties go to the block the line enters first
+        line['block'] = max(counts, key=counts.get) if counts else NO_BLOCK
+    for block, words_data in zip(block_predictions, block_words):
+        block['lines'] = sorted({word['line'] for word in words_data})
+        block['words'] = words_data
+    return line_predictions, block_predictions
+
+
+def extract_lines(image_paths, model, cache=None):
+    """docTR lines and words of each image (no layout pass), through the "doctr_lines" entries of `cache`."""
+    line_predictions = []
+    for image_path in image_paths:
+        doc = DocumentFile.from_images(image_path)
+        if cache is None:
+            line_predictions.append(get_line_predictions(model(doc)))
+        else:
+            line_predictions.append(cache.get_or_compute(doc[0], "doctr_lines", DOCTR_CONFIG, lambda: get_line_predictions(model(doc))))
+    return line_predictions
+
+
+def extract_regions(image_paths, layout_predictor, model, cache=None, reocr_empty=False,
+                    layout_batch_size=LAYOUT_BATCH_SIZE, layout_max_megapixels=LAYOUT_BATCH_MAX_MEGAPIXELS):
+    """Lines, words and blocks of each image from a single docTR pass and a single Surya pass.
+
+    Returns one {'line_predictions', 'block_predictions'} record per image, linked by
+    `link_page_regions`: the block records are built from the line OCR (see
+    `get_block_predictions_from_lines`), so each model runs once per page, and the layout
+    predictor is called on batches of images (`get_layout_bboxes_batch`). With `cache` (an
+    OCRCache) both passes are shared with every other consumer of the "doctr_lines" /
+    "layout_blocks" entries of the same image.
+    """
+    image_paths = list(image_paths)
+    images = [Image.open(image_path) for image_path in image_paths]
+    line_predictions = extract_lines(image_paths, model, cache=cache)
+
+    def build_blocks(index, image, block_bboxes):
+        return get_block_predictions_from_lines(image, layout_predictor, line_predictions[index], model=model,
+                                                reocr_empty=reocr_empty, block_bboxes=block_bboxes)
+
+    block_config = {**BLOCK_LINES_CONFIG, "reocr_empty": reocr_empty}
+    block_predictions = get_batched_block_predictions(images, layout_predictor, build_blocks, cache=cache, config=block_config,
+                                                      batch_size=layout_batch_size, max_megapixels=layout_max_megapixels)
+
+    records = []
+    for lines, blocks in zip(line_predictions, block_predictions):
+        link_page_regions(lines, blocks)
+        records.append({
+            'block_predictions': blocks,
+            'line_predictions': lines
+        })
+    return records
+
+
+def extract_page_regions(image_path, layout_predictor, model, cache=None, reocr_empty=False):
+    """`extract_regions` for a single image."""
+    return extract_regions([image_path], layout_predictor, model, cache=cache, reocr_empty=reocr_empty)[0]
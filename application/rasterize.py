@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pymupdf
+
+
+# Resolution PDF pages are rendered at (PyMuPDF's default is 72)
+RENDER_DPI = int(os.environ.get("DRISHTIKON_RENDER_DPI", "144"))
+# "rgb" or "gray"; gray pages are rendered with one channel and expanded to three for OCR/layout
+RENDER_COLORSPACE = os.environ.get("DRISHTIKON_RENDER_COLORSPACE", "rgb")
+# Worker processes used to render one document
+RENDER_WORKERS = int(os.environ.get("DRISHTIKON_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Documents with fewer pages are rendered in the calling process
+MIN_PARALLEL_PAGES = 8
+
+_colorspaces = {"rgb": pymupdf.csRGB, "gray": pymupdf.csGRAY}
+
+
+def open_pdf(source):
+    """Open a PDF from a path or from its bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return pymupdf.open(stream=bytes(source), filetype="pdf")
+    return pymupdf.open(source)
+
+
+def read_pdf(source):
+    """The bytes of a PDF given by path or bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def render_page(page, dpi=RENDER_DPI, colorspace=RENDER_COLORSPACE):
+    """Render one PyMuPDF page into a read-only H x W x 3 uint8 array."""
+    pix = page.get_pixmap(dpi=dpi, colorspace=_colorspaces[colorspace], alpha=False)
+    array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        array = np.repeat(array, 3, axis=2)
+    array.flags.writeable = False
+    return array
+
+
+# Document opened once per worker process by _init_worker
+_worker_doc = None
+
+
+def _init_worker(source):
+    global _worker_doc
+    _worker_doc = open_pdf(source)
+
+
+def _render_worker(args):
+    page_number, dpi, colorspace = args
+    return render_page(_worker_doc[page_number], dpi, colorspace)
+
+
+def iter_pdf_pages(source, dpi=RENDER_DPI, colorspace=RENDER_COLORSPACE, workers=RENDER_WORKERS):
+    """Yield the rendered pages of a PDF in page order, as soon as each one is ready.
+
+    Pages are rendered across a pool of `workers` processes, each opening the document once from
+    its bytes; short documents (or workers <= 1) are rendered serially in this process. Workers
+    are spawned, not forked: this runs from background threads of processes that hold torch
+    thread pools.
+    """
+    source = read_pdf(source)
+    with open_pdf(source) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count < MIN_PARALLEL_PAGES:
+            for page in doc:
+                yield render_page(page, dpi, colorspace)
+            return
+
+    with ProcessPoolExecutor(max_workers=min(workers, page_count), mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(source,)) as executor:
+        yield from executor.map(_render_worker, [(page_number, dpi, colorspace) for page_number in range(page_count)])
+
+
+class RenderedPages:
+    """Pages of a PDF that fill in from a background rasterization.
+
+    Behaves like a read-only list of page arrays: `len()` is known immediately, while indexing
+    and iteration only wait for the pages they reach. Downstream OCR can therefore start on the
+    first pages while the rest are still being rendered. The PDF is read into memory up front, so
+    the render does not depend on its file afterwards. If the render fails, `error` is set and
+    pages it did not reach raise it. `nbytes` is the size of all pages once rendered.
+    """
+
+    def __init__(self, source, dpi=RENDER_DPI, colorspace=RENDER_COLORSPACE, workers=RENDER_WORKERS):
+        source = read_pdf(source)
+        with open_pdf(source) as doc:
+            self._page_count = doc.page_count
+            zoom = dpi / 72
+            self.nbytes = sum(round(page.rect.width * zoom) * round(page.rect.height * zoom) * 3 for page in doc)
+        self._pages = []
+        self._error = None
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._render, args=(source, dpi, colorspace, workers), daemon=True)
+        self._thread.start()
+
+    def _render(self, source, dpi, colorspace, workers):
+        try:
+            for page in iter_pdf_pages(source, dpi, colorspace, workers):
+                with self._ready:
+                    self._pages.append(page)
+                    self._ready.notify_all()
+        except Exception as e:
+            with self._ready:
+                self._error = e
+                self._ready.notify_all()
+
+    @property
+    def error(self):
+        return self._error
+
+    def __len__(self):
+        return self._page_count
+
+    def __getitem__(self, page_number):
+        if page_number < 0:
+            page_number += self._page_count
+        if not 0 <= page_number < self._page_count:
+            raise IndexError("page number out of range")
+        with self._ready:
+            self._ready.wait_for(lambda: len(self._pages) > page_number or self._error is not None)
+            if len(self._pages) > page_number:
+                return self._pages[page_number]
+            raise self._error
+
+    def __iter__(self):
+        for page_number in range(self._page_count):
+            yield self[page_number]
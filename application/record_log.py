@@ -0,0 +1,131 @@
+import json
+import os
+
+
+# Records appended between two fsyncs of a RecordLog
+FSYNC_EVERY = 32
+# Same for QA journals: each record stands for an LLM generation of seconds, so every one is synced
+QA_JOURNAL_FSYNC_EVERY = 1
+
+
+def _scan_log(path):
+    """Keys of the complete records in a log file and the byte offset where they end.
+
+    Scanning stops at the first torn or unparsable line (e.g. from a crash mid-write).
+    """
+    keys = []
+    good_end = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            keys.append(record['key'])
+            good_end += len(line)
+    return keys, good_end
+
+
+def iter_record_log(path):
+    """Yield (key, value) for every complete record of a log file, in append order."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            yield record['key'], record['value']
+
+
+def read_record_log(path):
+    """Replay a record log into {key: value}; later records for a key replace earlier ones."""
+    return dict(iter_record_log(path))
+
+
+def replay_qa_journal(path, data):
+    """Apply a QA journal to annotations ({image_name: [qa, ...]}) in place.
+
+    Journal records are keyed by qa['id'] and hold the fields produced for that QA; records
+    for the same id are merged in order. Replaying twice gives the same result.
+    """
+    fields = {}
+    for key, value in iter_record_log(path):
+        fields.setdefault(key, {}).update(value)
+    for qa_data in data.values():
+        for qa in qa_data:
+            if qa['id'] in fields:
+                qa.update(fields[qa['id']])
+    return data
+
+
+class RecordLog:
+    """Append-only JSON-lines log of {key: value} records, used to checkpoint long batch runs.
+
+    Each record is one line, so a crash loses at most the records since the last fsync and
+    never corrupts earlier ones. Opening an existing log drops a torn last line and remembers
+    the completed keys, so a restarted run can skip them (`key in log`). `read_record_log`
+    replays the log for the final compaction.
+    """
+
+    def __init__(self, path, fsync_every=FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+
+        keys = []
+        if os.path.exists(path):
+            keys, good_end = _scan_log(path)
+            if os.path.getsize(path) > good_end:
+                os.truncate(path, good_end)
+        self._keys = set(keys)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def append(self, key, value):
+        self._file.write(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + "\n")
+        self._keys.add(key)
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        """Flush buffered records and fsync them to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def qa_journal_path(output_path):
+    """Journal of the predictions written to `output_path`: `<output>.journal.jsonl`."""
+    return os.path.splitext(output_path)[0] + ".journal.jsonl"
+
+
+def open_qa_journal(path, data):
+    """Resume a QA run: replay the journal at `path` into the annotations `data` (see
+    `replay_qa_journal`) and return it as a RecordLog to append the next predictions to."""
+    replay_qa_journal(path, data)
+    return RecordLog(path, fsync_every=QA_JOURNAL_FSYNC_EVERY)
@@ -0,0 +1,167 @@
+import re
+from collections import Counter
+from types import MappingProxyType
+
+import numpy as np
+
+
+# Character n-gram size used by the inverted index
+NGRAM_SIZE = 3
+
+# fuzzywuzzy's full_process(force_ascii=True): drop latin-1 bytes, keep letters/numbers, lowercase
+_latin1_table = {i: None for i in range(128, 256)}
+_non_word = re.compile(r"(?ui)\W")
+
+
+def process_for_token_set(text):
+    """Pre-process text the way fuzzywuzzy's token_set_ratio does before tokenising."""
+    text = text.translate(_latin1_table)
+    return _non_word.sub(" ", text).lower().strip()
+
+
+# Runs of characters that process_for_token_set keeps unchanged (word characters outside latin-1)
+_clean_run = re.compile(r"[^\W\u0080-\u00ff]+")
+
+
+def char_ngrams(token, n=NGRAM_SIZE):
+    return [token[i:i + n] for i in range(len(token) - n + 1)]
+
+
+def clean_ngrams(lower_text):
+    """N-grams of a lowercased text that survive process_for_token_set unchanged.
+
+    Every such n-gram also appears inside a token of the processed text, so it can be
+    looked up in the n-gram postings.
+    """
+    return [gram for run in _clean_run.findall(lower_text) for gram in char_ngrams(run)]
+
+
+def token_set_ngrams(tokens):
+    return [gram for token in tokens for gram in char_ngrams(token)]
+
+
+def _frozen_array(values, dtype, shape=None):
+    array = np.array(values, dtype=dtype)
+    if shape is not None:
+        array = array.reshape(shape)
+    array.flags.writeable = False
+    return array
+
+
+class RegionIndex:
+    """Immutable, array-backed view over the OCR regions of one document.
+
+    Built once from the output of `cached_line_predictions` / `cached_block_predictions`
+    and shared by every question asked on that document, so the per-question matching,
+    word-level and page-voting code never re-normalises the region texts.
+
+    Attributes:
+        regions: the original region dicts (must not be mutated)
+        texts, lower_texts, token_texts: raw, lowercased and token_set processed texts
+        token_sets: frozenset of tokens of each processed text
+        lengths: int array of raw text lengths
+        pages: int array of page ids (0 when the region has no `page`)
+        bboxes: float array of shape (N, 4)
+        word_texts: per region, tuple of lowercased word texts (empty for blocks)
+
+    Inverted index (built alongside, used to prune candidates before fuzzy scoring):
+        token_postings: processed token -> sorted array of region ids containing it
+        ngram_postings: character n-gram of a processed token -> sorted array of region ids
+        lower_lengths: int array of lowercased text lengths
+        clean_ngram_counts: number of clean n-gram positions in each lowercased text
+        token_set_lengths: length of the sorted, space-joined token set of each region
+        token_set_ngram_counts: number of n-gram positions over each region's token set
+    """
+
+    __slots__ = ('regions', 'texts', 'lower_texts', 'token_texts', 'token_sets',
+                 'lengths', 'pages', 'bboxes', 'word_texts',
+                 'token_postings', 'ngram_postings', 'lower_lengths', 'clean_ngram_counts',
+                 'token_set_lengths', 'token_set_ngram_counts')
+
+    def __init__(self, predictions):
+        regions = tuple(predictions)
+        texts = tuple(region['text'] for region in regions)
+        lower_texts = tuple(text.lower() for text in texts)
+        token_texts = tuple(process_for_token_set(text) for text in lower_texts)
+
+        _set = object.__setattr__
+        _set(self, 'regions', regions)
+        _set(self, 'texts', texts)
+        _set(self, 'lower_texts', lower_texts)
+        _set(self, 'token_texts', token_texts)
+        token_sets = tuple(frozenset(text.split()) for text in token_texts)
+        _set(self, 'token_sets', token_sets)
+        _set(self, 'lengths', _frozen_array([len(text) for text in texts], np.int64))
+        _set(self, 'pages', _frozen_array([region.get('page', 0) for region in regions], np.int64))
+        _set(self, 'bboxes', _frozen_array([region['bbox'] for region in regions], np.float64, (-1, 4)))
+        _set(self, 'word_texts', tuple(
+            tuple(word['text'].lower() for word in region.get('words', ())) for region in regions
+        ))
+
+        token_postings = {}
+        ngram_postings = {}
+        for region_id, tokens in enumerate(token_sets):
+            for token in tokens:
+                token_postings.setdefault(token, []).append(region_id)
+            for gram in set(token_set_ngrams(tokens)):
+                ngram_postings.setdefault(gram, []).append(region_id)
+        _set(self, 'token_postings', MappingProxyType(
+            {token: _frozen_array(ids, np.int64) for token, ids in token_postings.items()}))
+        _set(self, 'ngram_postings', MappingProxyType(
+            {gram: _frozen_array(ids, np.int64) for gram, ids in ngram_postings.items()}))
+        _set(self, 'lower_lengths', _frozen_array([len(text) for text in lower_texts], np.int64))
+        _set(self, 'clean_ngram_counts', _frozen_array([len(clean_ngrams(text)) for text in lower_texts], np.int64))
+        _set(self, 'token_set_lengths', _frozen_array([len(" ".join(tokens)) for tokens in token_sets], np.int64))
+        _set(self, 'token_set_ngram_counts', _frozen_array([len(token_set_ngrams(tokens)) for tokens in token_sets], np.int64))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RegionIndex is immutable")
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __reduce__(self):
+        return (RegionIndex, (self.regions,))
+
+    def lookup(self, query_lower):
+        """Look up one lowercased query in the inverted index.
+
+        Returns a dict with, per region:
+            clean_hits: clean n-gram positions of the query whose n-gram occurs in the region
+            token_set_hits: n-gram positions of the query's token set whose n-gram occurs in the region
+            shares_token: whether the region contains one of the query's processed tokens
+        plus the query-side sizes needed to bound fuzzy scores.
+        """
+        tokens = set(process_for_token_set(query_lower).split())
+        clean_grams = clean_ngrams(query_lower)
+        token_grams = token_set_ngrams(tokens)
+
+        clean_hits = np.zeros(len(self), dtype=np.int64)
+        for gram, count in Counter(clean_grams).items():
+            if gram in self.ngram_postings:
+                clean_hits[self.ngram_postings[gram]] += count
+        token_set_hits = np.zeros(len(self), dtype=np.int64)
+        for gram, count in Counter(token_grams).items():
+            if gram in self.ngram_postings:
+                token_set_hits[self.ngram_postings[gram]] += count
+        shares_token = np.zeros(len(self), dtype=bool)
+        for token in tokens:
+            if token in self.token_postings:
+                shares_token[self.token_postings[token]] = True
+
+        return {
+            'clean_hits': clean_hits,
+            'token_set_hits': token_set_hits,
+            'shares_token': shares_token,
+            'length': len(query_lower),
+            'clean_ngram_count': len(clean_grams),
+            'token_set_length': len(" ".join(sorted(tokens))),
+            'token_set_ngram_count': len(token_grams),
+        }
+
+
+def as_region_index(predictions):
+    """Return `predictions` as a RegionIndex, building one if a plain list is given."""
+    if isinstance(predictions, RegionIndex):
+        return predictions
+    return RegionIndex(predictions)
@@ -0,0 +1,83 @@
+import math
+import os
+
+import numpy as np
+
+from matching import get_question_terms
+from region_index import process_for_token_set
+
+
+# Token budget of the document context given to the LLM (documents that fit are passed whole)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("DRISHTIKON_CONTEXT_TOKENS", "3072"))
+# When the answer is not found in a narrowed context, retry once with the budget multiplied by this (1 disables)
+CONTEXT_RETRY_FACTOR = int(os.environ.get("DRISHTIKON_CONTEXT_RETRY_FACTOR", "4"))
+# Rough characters per LLM token, used to estimate the size of region texts without the tokenizer
+CHARS_PER_TOKEN = 4
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Weight of the character n-gram overlap with the question (robust to OCR errors) next to normalized BM25
+FUZZY_WEIGHT = 0.5
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def bm25_scores(question_text, index):
+    """BM25 score of every region of a RegionIndex against the question's terms.
+
+    Regions are short (lines or layout blocks), so term frequency is taken as presence and
+    the postings of the index give the document frequencies directly.
+    """
+    scores = np.zeros(len(index), dtype=np.float64)
+    if len(index) == 0:
+        return scores
+    lengths = np.array([len(tokens) for tokens in index.token_sets], dtype=np.float64)
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+    terms = {token for term in get_question_terms(question_text) for token in process_for_token_set(term).split()}
+    for term in terms:
+        postings = index.token_postings.get(term)
+        if postings is None:
+            continue
+        idf = math.log(1 + (len(index) - len(postings) + 0.5) / (len(postings) + 0.5))
+        scores[postings] += idf * (BM25_K1 + 1) / (1 + length_norm[postings])
+    return scores
+
+
+def rank_regions(question_text, index):
+    """Region ids of a RegionIndex ordered by relevance to the question (BM25 plus fuzzy n-gram overlap)."""
+    scores = bm25_scores(question_text, index)
+    if scores.max(initial=0) > 0:
+        scores /= scores.max()
+    lookup = index.lookup(" ".join(get_question_terms(question_text)))
+    if lookup['token_set_ngram_count']:
+        scores += FUZZY_WEIGHT * lookup['token_set_hits'] / lookup['token_set_ngram_count']
+    # stable: ties keep reading order
+    return np.argsort(-scores, kind='stable')
+
+
+def pack_regions(index, ranked_ids, budget):
+    """Take regions in ranked order while they fit in `budget` tokens; returned in reading order."""
+    selected = []
+    used = 0
+    for region_id in ranked_ids:
+        tokens = estimate_tokens(index.texts[region_id])
+        if used + tokens <= budget:
+            selected.append(int(region_id))
+            used += tokens
+    return sorted(selected)
+
+
+def retrieve_context(question_text, index, gap, budget=CONTEXT_TOKEN_BUDGET):
+    """LLM context for a question: the regions most relevant to it, within a token budget.
+
+    Returns (context, region_ids). The context joins the region texts in reading order with
+    `gap`; `region_ids` are the regions it holds, whose page and bbox stay available in the index.
+    A document that fits in the budget is passed whole.
+    """
+    if sum(estimate_tokens(text) for text in index.texts) <= budget:
+        region_ids = list(range(len(index)))
+    else:
+        region_ids = pack_regions(index, rank_regions(question_text, index), budget)
+    return "".join(index.texts[region_id] + gap for region_id in region_ids), region_ids
@@ -0,0 +1,131 @@
+import contextlib
+import glob
+import multiprocessing
+import os
+
+from record_log import RecordLog, iter_record_log, read_record_log
+
+
+# Worker processes used by run_sharded, and threads each of them may use
+NUM_WORKERS = int(os.environ.get("DRISHTIKON_NUM_WORKERS", "1"))
+THREADS_PER_WORKER = int(os.environ.get("DRISHTIKON_THREADS_PER_WORKER", "0"))
+
+_thread_env_vars = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def shard_log_path(log_path, shard):
+    base, ext = os.path.splitext(log_path)
+    return f"{base}.shard{shard}{ext}"
+
+
+def shard_log_paths(log_path):
+    base, ext = os.path.splitext(log_path)
+    return sorted(glob.glob(f"{glob.escape(base)}.shard*{ext}"))
+
+
+@contextlib.contextmanager
+def pinned_thread_env(num_threads):
+    """Set the BLAS / OpenMP thread env vars to `num_threads` while processes are started.
+
+    The pools read them when the libraries load, which in a spawned worker happens while it
+    re-imports the calling script, so they must be in the environment it inherits.
+    """
+    saved = {var: os.environ.get(var) for var in _thread_env_vars}
+    os.environ.update({var: str(num_threads) for var in _thread_env_vars})
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
+
+def pin_torch_threads(num_threads):
+    """Limit torch's intra-op thread pool of this process to `num_threads`."""
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def _run_shard(shard, items, init_worker, process_item, log_path, num_threads, batch_size):
+    if num_threads:
+        pin_torch_threads(num_threads)
+    state = init_worker()
+    with RecordLog(shard_log_path(log_path, shard)) as log:
+        if batch_size is None:
+            for key, item in items:
+                log.append(key, process_item(state, item))
+            return
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            for (key, _), value in zip(batch, process_item(state, [item for _, item in batch])):
+                log.append(key, value)
+
+
+def _completed_keys(log_path):
+    keys = set()
+    for path in [log_path] + shard_log_paths(log_path):
+        keys.update(key for key, _ in iter_record_log(path))
+    return keys
+
+
+def run_sharded(items, init_worker, process_item, log_path, num_workers=NUM_WORKERS, num_threads=THREADS_PER_WORKER,
+                batch_size=None):
+    """Process (key, item) pairs across `num_workers` processes and merge the results into `log_path`.
+
+    Each worker's thread pools are pinned to `num_threads` (default: CPU count / workers): the
+    BLAS / OpenMP env vars are set before it is spawned, torch's pool inside it. It calls
+    `init_worker()` once to load its models and then appends `process_item(state, item)` for
+    every item of its shard to its own RecordLog. Items are dealt round-robin, items already
+    in the logs are skipped (resume), and the shard logs are merged into `log_path` in the
+    order of `items`, so the result does not depend on the number of workers. With
+    `batch_size`, `process_item(state, items)` gets lists of up to `batch_size` items of a shard
+    and returns one result per item (for models that batch across images).
+
+    `init_worker` and `process_item` must be module-level functions, and the calling script
+    must guard its entry point with `if __name__ == "__main__":` (workers are spawned).
+    """
+    items = list(items)
+    completed = _completed_keys(log_path)
+    pending = [(key, item) for key, item in items if key not in completed]
+    num_workers = max(1, min(num_workers, len(pending)))
+    if not num_threads:
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    if num_workers == 1:
+        if pending:
+            _run_shard(0, pending, init_worker, process_item, log_path, num_threads, batch_size)
+    else:
+        context = multiprocessing.get_context("spawn")
+        processes = []
+        with pinned_thread_env(num_threads):
+            for shard in range(num_workers):
+                process = context.Process(target=_run_shard, args=(
+                    shard, pending[shard::num_workers], init_worker, process_item, log_path, num_threads, batch_size))
+                process.start()
+                processes.append(process)
+        for process in processes:
+            process.join()
+        failed = [shard for shard, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"OCR shards {failed} failed; rerun to resume from {log_path}")
+
+    merge_shard_logs(log_path, [key for key, _ in items])
+
+
+def merge_shard_logs(log_path, keys):
+    """Append the shard logs' records to `log_path` in `keys` order, then remove the shard logs."""
+    paths = shard_log_paths(log_path)
+    records = {}
+    for path in paths:
+        records.update(read_record_log(path))
+    with RecordLog(log_path) as log:
+        for key in keys:
+            if key in records and key not in log:
+                log.append(key, records[key])
+    for path in paths:
+        os.remove(path)
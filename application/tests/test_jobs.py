@@ -0,0 +1,108 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobQueue
+
+
+def wait_done(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while not queue.get(job_id).done:
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(workers=1)
+    yield queue
+    queue.shutdown()
+
+
+def test_job_runs_through_its_states(queue):
+    started, release = threading.Event(), threading.Event()
+
+    def work(x, progress, scale=1):
+        progress("ocr")
+        started.set()
+        release.wait(5)
+        progress("llm")
+        return x * scale
+
+    job_id = queue.submit("predict", work, 21, scale=2)
+    started.wait(5)
+    job = queue.get(job_id)
+    assert job.status == JOB_RUNNING and job.stage == "ocr" and not job.done and job.finished is None
+
+    # one worker: the next job waits in the queue
+    queued_id = queue.submit("other", lambda progress: None)
+    assert queue.get(queued_id).status == JOB_QUEUED
+
+    release.set()
+    job = wait_done(queue, job_id)
+    assert job.status == JOB_DONE and job.result == 42 and job.error is None
+    assert [stage for stage, _ in job.stages] == ["ocr", "llm"] and job.stage == "llm"
+    assert job.finished >= job.created
+    assert wait_done(queue, queued_id).status == JOB_DONE
+
+
+def test_failed_job_keeps_its_error(queue):
+    def work(progress):
+        raise ValueError("no pages")
+
+    job = wait_done(queue, queue.submit("predict", work))
+    assert job.status == JOB_FAILED and job.error == "ValueError: no pages" and job.result is None
+    assert job.finished is not None
+
+
+def test_streaming_job_publishes_partial_results(queue):
+    def work(progress, on_partial):
+        on_partial({'answer': "The"})
+        on_partial({'answer': "The date"})
+        return "The date is 12/03"
+
+    job = wait_done(queue, queue.submit("predict", work, stream=True))
+    assert job.partial == {'answer': "The date"} and job.result == "The date is 12/03"
+
+
+def test_keyed_jobs_are_deduplicated_while_unfinished(queue):
+    release = threading.Event()
+    calls = []
+
+    def work(progress):
+        calls.append(1)
+        release.wait(5)
+
+    first = queue.submit("prepare", work, key=("prepare", "abc"))
+    assert queue.submit("prepare", work, key=("prepare", "abc")) == first
+    other = queue.submit("prepare", work, key=("prepare", "def"))
+    assert other != first
+    release.set()
+    wait_done(queue, first)
+    wait_done(queue, other)
+    assert len(calls) == 2
+
+    # finished: the same key starts a new job
+    again = queue.submit("prepare", work, key=("prepare", "abc"))
+    assert again != first
+    wait_done(queue, again)
+
+
+def test_finished_jobs_are_pruned_after_ttl():
+    queue = JobQueue(workers=1, ttl=0)
+    try:
+        job_id = queue.submit("predict", lambda progress: 1)
+        wait_done(queue, job_id)
+        time.sleep(0.01)
+        # pruned on the next submit
+        wait_done(queue, queue.submit("predict", lambda progress: 2))
+        assert queue.get(job_id) is None
+    finally:
+        queue.shutdown()
+    assert queue.get("unknown") is None
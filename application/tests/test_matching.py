@@ -0,0 +1,134 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from matching import (ANSWER_WEIGHT, CUT_OFF_THRESHOLD, PRUNING_APPROXIMATE, PRUNING_EXACT, PRUNING_OFF,
+                      QUESTION_WEIGHT, get_matched_regions, get_matched_regions_batch, get_question_terms,
+                      partial_ratio)
+from region_index import RegionIndex
+
+# requirements-test.txt; without python-Levenshtein, fuzzywuzzy falls back to difflib and scores differently
+import Levenshtein  # noqa: F401
+from fuzzywuzzy import fuzz
+
+WORDS = ["date", "act", "revenue", "amendment", "subject", "tax", "total", "invoice", "amount", "due",
+         "india", "ministry", "of", "the", "finance", "2023", "rs.", "12,500", "section", "notice"]
+
+
+def baseline_matched_regions(question_text, target_text, predictions, max_matches):
+    """The per-region fuzzywuzzy loop the batched matcher replaced."""
+    question_terms = get_question_terms(question_text)
+    matched_regions = []
+    for region in predictions:
+        region_text = region['text']
+        region_copy = region.copy()
+        if target_text.lower() in region_text.lower():
+            region_copy['match_score'] = 100
+            region_copy['match_details'] = {'exact_match': True, 'answer_score': 100, 'question_score': 100}
+            matched_regions.append(region_copy)
+            continue
+
+        partial_score = fuzz.partial_ratio(target_text.lower(), region_text.lower())
+        token_score = fuzz.token_set_ratio(target_text.lower(), region_text.lower())
+        target_len = len(target_text)
+        region_len = len(region_text)
+        length_factor = min(1.0, region_len / min(50, target_len))
+        if region_len > 10:
+            answer_score = (partial_score * 0.3) + (token_score * 0.5) + (length_factor * 100 * 0.2)
+        else:
+            answer_score = (partial_score * 0.3) + (token_score * 0.4) + (length_factor * 100 * 0.3)
+            if region_len < 5 and partial_score < 100:
+                answer_score *= 0.5
+        if region_len < 5:
+            answer_score *= 0.5
+
+        partial_question_scores = [fuzz.partial_ratio(term, region_text.lower()) for term in question_terms]
+        token_question_scores = [fuzz.token_set_ratio(term, region_text.lower()) for term in question_terms]
+        best_partial_question = max(partial_question_scores) if partial_question_scores else 0
+        best_token_question = max(token_question_scores) if token_question_scores else 0
+        question_score = (best_partial_question * 0.4) + (best_token_question * 0.6)
+        combined_score = (answer_score * ANSWER_WEIGHT) + (question_score * QUESTION_WEIGHT)
+        if combined_score >= CUT_OFF_THRESHOLD:
+            region_copy['match_score'] = combined_score
+            region_copy['match_details'] = {
+                'exact_match': False,
+                'answer_score': answer_score,
+                'question_score': question_score,
+                'answer_weight': ANSWER_WEIGHT,
+                'question_weight': QUESTION_WEIGHT
+            }
+            matched_regions.append(region_copy)
+
+    matched_regions.sort(key=lambda x: x['match_score'], reverse=True)
+    return matched_regions[:max_matches]
+
+
+def noisy(rng, word):
+    # OCR-like noise: dropped, swapped or replaced characters
+    if len(word) > 2 and rng.random() < 0.3:
+        i = rng.randrange(len(word))
+        word = word[:i] + rng.choice(["", "l", "0", word[i:i + 2][::-1]]) + word[i + 1:]
+    return word
+
+
+def random_case(rng):
+    regions = [{'text': " ".join(noisy(rng, rng.choice(WORDS)) for _ in range(rng.randint(1, 8))),
+                'bbox': [0, i, 10, i + 1], 'page': i % 3} for i in range(rng.randint(1, 40))]
+    question = "What is the " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))) + "?"
+    answer = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5)))
+    return question, answer, regions
+
+
+def assert_same_matches(matches, expected):
+    assert [match['bbox'] for match in matches] == [match['bbox'] for match in expected]
+    for match, expected_match in zip(matches, expected):
+        assert match['match_score'] == pytest.approx(expected_match['match_score'])
+        assert match['match_details'] == pytest.approx(expected_match['match_details'])
+
+
+def test_partial_ratio_matches_fuzzywuzzy():
+    rng = random.Random(0)
+    pairs = [("subject", "date act revenue amendment"), ("tax", "date act revenue amendment"), ("", "abc"), ("abc", "abc")]
+    pairs += [(" ".join(rng.choices(WORDS, k=rng.randint(1, 3))), " ".join(noisy(rng, w) for w in rng.choices(WORDS, k=rng.randint(1, 8))))
+              for _ in range(2000)]
+    for s1, s2 in pairs:
+        assert partial_ratio(s1, s2) == fuzz.partial_ratio(s1, s2), (s1, s2)
+        assert partial_ratio(s2, s1) == fuzz.partial_ratio(s2, s1), (s2, s1)
+
+
+@pytest.mark.parametrize("pruning", [PRUNING_OFF, PRUNING_EXACT])
+def test_matched_regions_match_baseline(pruning, monkeypatch):
+    # small candidate limit so the pruning path is exercised on small documents
+    monkeypatch.setattr("matching.CANDIDATE_LIMIT", 3)
+    rng = random.Random(1)
+    for _ in range(3000):
+        question, answer, regions = random_case(rng)
+        expected = baseline_matched_regions(question, answer, regions, 5)
+        assert_same_matches(get_matched_regions(question, answer, RegionIndex(regions), 5, pruning), expected)
+
+
+def test_approximate_pruning_returns_scored_subset(monkeypatch):
+    monkeypatch.setattr("matching.CANDIDATE_LIMIT", 3)
+    rng = random.Random(2)
+    for _ in range(200):
+        question, answer, regions = random_case(rng)
+        baseline_scores = {tuple(match['bbox']): match['match_score'] for match in baseline_matched_regions(question, answer, regions, len(regions))}
+        for match in get_matched_regions(question, answer, RegionIndex(regions), 5, PRUNING_APPROXIMATE):
+            assert match['match_score'] == pytest.approx(baseline_scores[tuple(match['bbox'])])
+
+
+@pytest.mark.parametrize("candidate_limit", [200, 3])
+def test_batch_matches_baseline(candidate_limit, monkeypatch):
+    # 3: the pruned per-pair path
+    monkeypatch.setattr("matching.CANDIDATE_LIMIT", candidate_limit)
+    rng = random.Random(3)
+    for _ in range(300):
+        _, _, regions = random_case(rng)
+        pairs = [random_case(rng)[:2] for _ in range(rng.randint(1, 4))]
+        results = get_matched_regions_batch(pairs, RegionIndex(regions), 5)
+        for (question, answer), matches in zip(pairs, results):
+            assert_same_matches(matches, baseline_matched_regions(question, answer, regions, 5))
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from ocr_store import (OCRStore, compact_record_log, export_json, import_json, load_ocr_data, store_paths,
+                       write_ocr_store)
+from record_log import RecordLog
+
+DATA = {
+    "a.png": [
+        {'bbox': [1.5, 2.0, 30.25, 12.0], 'text': "Date: 12/03", 'page': 0, 'block': 1,
+         'words': [{'bbox': [1.5, 2.0, 10.0, 12.0], 'text': "Date:"}, {'bbox': [11.0, 2.0, 30.25, 12.0], 'text': "12/03"}]},
+        {'bbox': [0, 0, 40, 20], 'text': "Date: 12/03 मंत्रालय", 'lines': [0, 2],
+         'words': [{'bbox': [1.5, 2.0, 10.0, 12.0], 'text': "Date:", 'line': 0},
+                   {'bbox': [11.0, 2.0, 30.0, 12.0], 'text': "मंत्रालय"}]},
+        {'bbox': [5.0, 25.0, 9.0, 30.0], 'text': "", 'words': []},
+    ],
+    # images without any region stay in the store
+    "empty.png": [],
+    "b.png": [{'bbox': [0.0, 0.0, 1.0, 1.0], 'text': "no words", 'page': 3, 'lines': []}],
+}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "store.ocr")
+    write_ocr_store(path, DATA)
+    store = OCRStore(path)
+    assert store.has_links
+    assert list(store) == list(DATA)
+    assert len(store) == 3 and "empty.png" in store and "c.png" not in store
+    assert dict(store.items()) == DATA
+    assert store.get("c.png", "missing") == "missing"
+    # layout blocks keep integer boxes
+    assert all(isinstance(x, int) for x in store["a.png"][1]['bbox'])
+
+
+def test_rewrite_replaces_store(tmp_path):
+    path = str(tmp_path / "store.ocr")
+    write_ocr_store(path, DATA)
+    write_ocr_store(path, {"b.png": DATA["b.png"]})
+    assert dict(OCRStore(path).items()) == {"b.png": DATA["b.png"]}
+    # no temporary directories left next to the store
+    assert os.listdir(tmp_path) == ["store.ocr"]
+
+
+def test_version_1_store_loads_without_links(tmp_path):
+    path = str(tmp_path / "store.ocr")
+    write_ocr_store(path, DATA)
+    with open(os.path.join(path, "index.json")) as f:
+        meta = json.load(f)
+    meta['version'] = 1
+    with open(os.path.join(path, "index.json"), 'w') as f:
+        json.dump(meta, f)
+    for name in os.listdir(path):
+        if name.startswith(('region_has_block', 'region_block', 'region_has_lines', 'region_line', 'word_has_line', 'word_line')):
+            os.remove(os.path.join(path, name))
+
+    store = OCRStore(path)
+    assert not store.has_links
+    block = store["a.png"][1]
+    assert 'lines' not in block and all('line' not in word for word in block['words'])
+    assert 'block' not in store["a.png"][0]
+
+
+def test_unsupported_version(tmp_path):
+    path = str(tmp_path / "store.ocr")
+    write_ocr_store(path, DATA)
+    with open(os.path.join(path, "index.json"), 'w') as f:
+        json.dump({'version': 99, 'images': {}}, f)
+    with pytest.raises(ValueError):
+        OCRStore(path)
+
+
+def test_json_conversion(tmp_path):
+    json_path, store_path = str(tmp_path / "store.json"), str(tmp_path / "store.ocr")
+    with open(json_path, 'w') as f:
+        json.dump(DATA, f)
+    import_json(json_path, store_path)
+    assert isinstance(load_ocr_data(store_path), OCRStore)
+    export_json(store_path, str(tmp_path / "out.json"))
+    assert load_ocr_data(str(tmp_path / "out.json")) == DATA
+
+
+def test_compact_record_log_in_key_order(tmp_path):
+    json_path = str(tmp_path / "store.json")
+    store_path, log_path = store_paths(json_path)
+    assert store_path == str(tmp_path / "store.ocr") and log_path == str(tmp_path / "store.log.jsonl")
+    # appended in completion order, with a stale record for b.png
+    with RecordLog(log_path) as log:
+        log.append("b.png", [])
+        log.append("a.png", DATA["a.png"])
+        log.append("b.png", DATA["b.png"])
+
+    records = compact_record_log(log_path, json_path, store_path, keys=["a.png", "empty.png", "b.png"])
+    assert list(records) == ["a.png", "b.png"]
+    assert records["b.png"] == DATA["b.png"]
+    assert dict(OCRStore(store_path).items()) == records
+    with open(json_path) as f:
+        assert list(json.load(f)) == ["a.png", "b.png"]
@@ -0,0 +1,93 @@
+import copy
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from record_log import RecordLog, iter_record_log, open_qa_journal, qa_journal_path, read_record_log, replay_qa_journal
+
+
+def test_append_and_replay(tmp_path):
+    path = str(tmp_path / "run.log.jsonl")
+    with RecordLog(path, fsync_every=2) as log:
+        log.append("a", {'text': "ü"})
+        log.append("b", [1, 2])
+        log.append("a", {'text': "again"})
+        assert "a" in log and "c" not in log and len(log) == 2
+    assert list(iter_record_log(path)) == [("a", {'text': "ü"}), ("b", [1, 2]), ("a", {'text': "again"})]
+    # later records replace earlier ones
+    assert read_record_log(path) == {"a": {'text': "again"}, "b": [1, 2]}
+
+
+def test_missing_log_replays_empty(tmp_path):
+    assert read_record_log(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_torn_last_line_is_truncated_and_run_resumes(tmp_path):
+    path = str(tmp_path / "run.log.jsonl")
+    with RecordLog(path) as log:
+        log.append("a", 1)
+        log.append("b", 2)
+    complete_size = os.path.getsize(path)
+    # crash in the middle of writing the next record
+    with open(path, 'a') as f:
+        f.write('{"key": "c", "val')
+
+    assert read_record_log(path) == {"a": 1, "b": 2}
+    with RecordLog(path) as log:
+        assert os.path.getsize(path) == complete_size
+        assert "b" in log and "c" not in log
+        log.append("c", 3)
+    assert read_record_log(path) == {"a": 1, "b": 2, "c": 3}
+
+
+def test_unparsable_line_ends_the_log(tmp_path):
+    path = str(tmp_path / "run.log.jsonl")
+    with open(path, 'w') as f:
+        f.write('{"key": "a", "value": 1}\nnot json\n{"key": "b", "value": 2}\n')
+    with RecordLog(path) as log:
+        assert len(log) == 1
+    assert read_record_log(path) == {"a": 1}
+
+
+def test_creates_parent_directory(tmp_path):
+    path = str(tmp_path / "nested" / "run.log.jsonl")
+    with RecordLog(path) as log:
+        log.append("a", 1)
+    assert read_record_log(path) == {"a": 1}
+
+
+def annotations():
+    return {"a.png": [{'id': 1, 'question': "q1"}, {'id': 2, 'question': "q2"}],
+            "b.png": [{'id': 3, 'question': "q3"}]}
+
+
+def test_qa_journal_replay_merges_fields_per_id(tmp_path):
+    path = str(tmp_path / "out.journal.jsonl")
+    with RecordLog(path) as journal:
+        journal.append(1, {'line_level_predictions': "first"})
+        journal.append(3, {'block_level_predictions': []})
+        journal.append(1, {'line_level_predictions': "second", 'extra': True})
+
+    data = replay_qa_journal(path, annotations())
+    assert data["a.png"][0] == {'id': 1, 'question': "q1", 'line_level_predictions': "second", 'extra': True}
+    assert 'line_level_predictions' not in data["a.png"][1]
+    assert data["b.png"][0]['block_level_predictions'] == []
+    # idempotent
+    replayed = copy.deepcopy(data)
+    assert replay_qa_journal(path, replayed) == data
+
+
+def test_open_qa_journal_resumes(tmp_path):
+    path = qa_journal_path(str(tmp_path / "out.json"))
+    assert path == str(tmp_path / "out.journal.jsonl")
+
+    data = annotations()
+    with open_qa_journal(path, data) as journal:
+        assert journal.fsync_every == 1
+        journal.append(2, {'line_level_predictions': "two"})
+
+    data = annotations()
+    with open_qa_journal(path, data) as journal:
+        assert 2 in journal and 1 not in journal
+    assert data["a.png"][1]['line_level_predictions'] == "two"
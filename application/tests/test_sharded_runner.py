@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from record_log import RecordLog, iter_record_log
+from sharded_runner import pinned_thread_env, run_sharded, shard_log_path, shard_log_paths
+
+# items processed in this process (single-worker runs)
+processed = []
+
+
+def init_worker():
+    return "state"
+
+
+def process_item(state, item):
+    processed.append(item)
+    return {'item': item, 'state': state, 'threads': os.environ.get("OMP_NUM_THREADS"), 'pid': os.getpid()}
+
+
+def process_batch(state, items):
+    return [{'batch': list(items), 'item': item} for item in items]
+
+
+def fail_on_odd(state, item):
+    if item % 2:
+        raise RuntimeError("bad item")
+    return item
+
+
+def items(count):
+    return [(f"img{i}.png", i) for i in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def clear_processed():
+    processed.clear()
+
+
+def test_workers_merge_in_item_order(tmp_path):
+    log_path = str(tmp_path / "run.log.jsonl")
+    run_sharded(items(7), init_worker, process_item, log_path, num_workers=3, num_threads=2)
+
+    records = list(iter_record_log(log_path))
+    assert [key for key, _ in records] == [key for key, _ in items(7)]
+    assert [value['item'] for _, value in records] == list(range(7))
+    assert len({value['pid'] for _, value in records}) == 3 and os.getpid() not in {value['pid'] for _, value in records}
+    # the thread env vars are set before the workers start
+    assert {value['threads'] for _, value in records} == {"2"}
+    assert shard_log_paths(log_path) == []
+
+
+def test_resume_skips_completed_items(tmp_path):
+    log_path = str(tmp_path / "run.log.jsonl")
+    with RecordLog(log_path) as log:
+        log.append("img1.png", "done before")
+    # left behind by an interrupted multi-worker run
+    with RecordLog(shard_log_path(log_path, 1)) as log:
+        log.append("img3.png", "done in a shard")
+
+    run_sharded(items(5), init_worker, process_item, log_path, num_workers=1)
+
+    assert processed == [0, 2, 4]
+    values = dict(iter_record_log(log_path))
+    assert values["img1.png"] == "done before" and values["img3.png"] == "done in a shard"
+    assert list(values) == ["img1.png", "img0.png", "img2.png", "img3.png", "img4.png"]
+    assert shard_log_paths(log_path) == []
+
+    # nothing left to do
+    run_sharded(items(5), init_worker, process_item, log_path, num_workers=2)
+    assert processed == [0, 2, 4]
+
+
+def test_batches_within_a_shard(tmp_path):
+    log_path = str(tmp_path / "run.log.jsonl")
+    run_sharded(items(5), init_worker, process_batch, log_path, num_workers=1, batch_size=2)
+    assert [value['batch'] for _, value in iter_record_log(log_path)] == [[0, 1], [0, 1], [2, 3], [2, 3], [4]]
+
+
+def test_failed_shard_raises_and_keeps_its_progress(tmp_path):
+    log_path = str(tmp_path / "run.log.jsonl")
+    with pytest.raises(RuntimeError):
+        run_sharded(items(4), init_worker, fail_on_odd, log_path, num_workers=2)
+    # shard 0 (even items) completed; shard 1 failed on its first item
+    assert [key for key, _ in iter_record_log(shard_log_path(log_path, 0))] == ["img0.png", "img2.png"]
+
+
+def test_pinned_thread_env_restores_environment(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "8")
+    monkeypatch.delenv("MKL_NUM_THREADS", raising=False)
+    with pinned_thread_env(3):
+        assert os.environ["OMP_NUM_THREADS"] == "3" and os.environ["MKL_NUM_THREADS"] == "3"
+    assert os.environ["OMP_NUM_THREADS"] == "8" and "MKL_NUM_THREADS" not in os.environ
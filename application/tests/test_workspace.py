@@ -0,0 +1,77 @@
+import gc
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from workspace import Workspace, cleanup_stale_workspaces, document_cache_key
+
+
+def test_documents_are_content_addressed(tmp_path):
+    first, second = Workspace(str(tmp_path)), Workspace(str(tmp_path))
+    a = first.add_document(b"%PDF-1 a", "pdf", ".pdf")
+    assert first.add_document(b"%PDF-1 a", "pdf", ".pdf").path == a.path
+    b = second.add_document(b"%PDF-1 a", "pdf", ".pdf")
+    # same document in two sessions: separate files, one cache key
+    assert a.path != b.path and document_cache_key(a) == document_cache_key(b)
+    c = first.add_document(b"%PDF-1 c", "pdf", ".pdf")
+    assert document_cache_key(c) != document_cache_key(a)
+    assert sorted(os.listdir(first.path)) == sorted([os.path.basename(a.path), os.path.basename(c.path)])
+
+    image = first.add_image(Image.new("RGB", (4, 4), "white"))
+    assert image.document_type == "image" and image.path.endswith(".png")
+    with Image.open(image.path) as stored:
+        assert stored.size == (4, 4)
+
+
+def test_remove_documents_keeps_handles(tmp_path):
+    workspace = Workspace(str(tmp_path))
+    a = workspace.add_document(b"a", "pdf", ".pdf")
+    b = workspace.add_document(b"b", "pdf", ".pdf")
+    c = workspace.add_document(b"c", "pdf", ".pdf")
+    workspace.remove_documents(keep=[a, c])
+    assert os.path.exists(a.path) and not os.path.exists(b.path) and os.path.exists(c.path)
+    workspace.remove_document(b)
+    workspace.remove_document(a)
+    assert os.listdir(workspace.path) == [os.path.basename(c.path)]
+
+
+def test_cleanup_and_garbage_collection_remove_the_directory(tmp_path):
+    workspace = Workspace(str(tmp_path))
+    workspace.add_document(b"a", "pdf", ".pdf")
+    workspace.cleanup()
+    assert not os.path.exists(workspace.path)
+
+    path = Workspace(str(tmp_path)).path
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_stale_workspaces_are_reaped(tmp_path):
+    stale, active = Workspace(str(tmp_path)), Workspace(str(tmp_path))
+    stale.add_document(b"a", "pdf", ".pdf")
+    old = time.time() - 100
+    os.utime(stale.path, (old, old))
+    cleanup_stale_workspaces(str(tmp_path), ttl=50)
+    assert not os.path.exists(stale.path) and os.path.isdir(active.path)
+    # a missing root is not an error
+    cleanup_stale_workspaces(str(tmp_path / "missing"), ttl=50)
+
+
+def test_session_recovers_after_its_workspace_was_reaped(tmp_path):
+    workspace = Workspace(str(tmp_path))
+    a = workspace.add_document(b"a", "pdf", ".pdf")
+    old = time.time() - 100
+    os.utime(workspace.path, (old, old))
+    cleanup_stale_workspaces(str(tmp_path), ttl=50)
+
+    workspace.remove_documents(keep=[a])
+    workspace.remove_document(a)
+    b = workspace.add_document(b"b", "pdf", ".pdf")
+    assert os.path.exists(b.path)
+    # touched: not stale anymore
+    cleanup_stale_workspaces(str(tmp_path), ttl=50)
+    assert os.path.exists(b.path)
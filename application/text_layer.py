@@ -0,0 +1,108 @@
+import unicodedata
+
+import pymupdf
+
+from rasterize import RENDER_DPI, open_pdf
+
+
+# Per-page quality heuristic deciding whether the text layer is trusted or the page goes to docTR
+# Fewer words than this: no usable text layer
+TEXT_LAYER_MIN_WORDS = 5
+# Minimum share of characters that are not U+FFFD, private-use or control (broken font encodings)
+TEXT_LAYER_MIN_VALID_RATIO = 0.9
+# Minimum share of letters / digits among the valid non-space characters
+TEXT_LAYER_MIN_ALNUM_RATIO = 0.5
+# A page mostly covered by images with only a few words is a scan with a partial text layer
+TEXT_LAYER_SCAN_IMAGE_COVERAGE = 0.8
+TEXT_LAYER_SCAN_MIN_WORDS = 30
+
+
+def _pixel_bbox(rect, matrix):
+    rect = rect * matrix
+    return [round(rect.x0, 2), round(rect.y0, 2), round(rect.x1, 2), round(rect.y1, 2)]
+
+
+def get_text_layer_line_predictions(page, dpi=RENDER_DPI):
+    """Line records ({'bbox', 'text', 'words'}) from the embedded text of one PDF page.
+
+    Boxes are in the pixel space of the page rendered at `dpi` (rotation included), so they
+    line up with docTR predictions on the rendered page. Records are tagged with
+    'source': 'text_layer'. Pages without a text layer give an empty list.
+    """
+    matrix = page.rotation_matrix * pymupdf.Matrix(dpi / 72, dpi / 72)
+
+    lines_words = []
+    current_line = None
+    for x0, y0, x1, y1, text, block_no, line_no, _ in page.get_text("words"):
+        if current_line != (block_no, line_no):
+            current_line = (block_no, line_no)
+            lines_words.append([])
+        lines_words[-1].append({'bbox': _pixel_bbox(pymupdf.Rect(x0, y0, x1, y1), matrix), 'text': text})
+
+    line_predictions = []
+    for words_data in lines_words:
+        boxes = [word['bbox'] for word in words_data]
+        output = {}
+        output['bbox'] = [min(box[0] for box in boxes), min(box[1] for box in boxes),
+                          max(box[2] for box in boxes), max(box[3] for box in boxes)]
+        output['text'] = " ".join(word['text'] for word in words_data)
+        output['words'] = words_data
+        output['source'] = "text_layer"
+        line_predictions.append(output)
+    return line_predictions
+
+
+def _image_coverage(page):
+    """Fraction of the page area covered by placed images (summed over images, capped at 1)."""
+    page_area = abs(page.rect)
+    if page_area == 0:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(pymupdf.Rect(info['bbox']) & page.rect)
+    return min(covered / page_area, 1.0)
+
+
+def text_layer_quality(page, line_predictions):
+    """Quality metrics of a page's text layer and whether to trust it over docTR ('trusted')."""
+    words = [word['text'] for output in line_predictions for word in output['words']]
+    chars = [char for word in words for char in word if not char.isspace()]
+    valid = [char for char in chars if char != "\ufffd" and unicodedata.category(char) not in ("Co", "Cc", "Cs")]
+    valid_ratio = len(valid) / len(chars) if chars else 0.0
+    alnum_ratio = sum(char.isalnum() for char in valid) / len(valid) if valid else 0.0
+    image_coverage = _image_coverage(page)
+
+    trusted = (
+        len(words) >= TEXT_LAYER_MIN_WORDS
+        and valid_ratio >= TEXT_LAYER_MIN_VALID_RATIO
+        and alnum_ratio >= TEXT_LAYER_MIN_ALNUM_RATIO
+        and not (image_coverage >= TEXT_LAYER_SCAN_IMAGE_COVERAGE and len(words) < TEXT_LAYER_SCAN_MIN_WORDS)
+    )
+    return {
+        'words': len(words),
+        'valid_ratio': valid_ratio,
+        'alnum_ratio': alnum_ratio,
+        'image_coverage': image_coverage,
+        'trusted': trusted,
+    }
+
+
+def extract_text_layer(source, dpi=RENDER_DPI):
+    """Line records of a PDF (path or bytes) from its text layer, for the pages where it can be trusted.
+
+    Returns (line_predictions, ocr_page_numbers): the {'bbox', 'text', 'words', 'page'} records of
+    every trusted page in page order, and the pages whose text layer is missing or fails
+    `text_layer_quality` and therefore need docTR.
+    """
+    line_predictions = []
+    ocr_page_numbers = []
+    with open_pdf(source) as doc:
+        for page in doc:
+            page_lines = get_text_layer_line_predictions(page, dpi)
+            if not text_layer_quality(page, page_lines)['trusted']:
+                ocr_page_numbers.append(page.number)
+                continue
+            for output in page_lines:
+                output['page'] = page.number
+                line_predictions.append(output)
+    return line_predictions, ocr_page_numbers
@@ -0,0 +1,114 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import weakref
+
+
+# Root of the per-session workspaces of the app
+WORKSPACE_ROOT = os.environ.get("DRISHTIKON_WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "drishtikon-workspaces"))
+# Workspaces not used for this many seconds are removed (sessions that ended without cleaning up)
+WORKSPACE_TTL = int(os.environ.get("DRISHTIKON_WORKSPACE_TTL", str(6 * 3600)))
+
+
+class DocumentHandle:
+    """A document stored in a workspace: content digest, file path and type ("image" or "pdf").
+
+    The digest identifies the document for the prediction caches, so the same upload in two
+    sessions shares its OCR while different uploads never collide (see `document_cache_key`).
+    """
+
+    __slots__ = ('digest', 'path', 'document_type')
+
+    def __init__(self, digest, path, document_type):
+        self.digest = digest
+        self.path = path
+        self.document_type = document_type
+
+    def __repr__(self):
+        return f"DocumentHandle({self.digest[:12]}, {self.document_type})"
+
+
+def document_cache_key(document):
+    """Cache key of a DocumentHandle: content digest and type, independent of the workspace path."""
+    return f"{document.digest}|{document.document_type}"
+
+
+class Workspace:
+    """Private directory of one app session holding its uploaded documents.
+
+    Documents are stored under their SHA-256, so re-uploading the same file reuses it. The
+    directory is removed by `cleanup()`, when the Workspace is garbage collected (the session
+    state is dropped) or, for sessions that died, by `cleanup_stale_workspaces`. A session that
+    was only idle past the TTL gets an empty directory back on its next `touch` / `add_document`.
+    """
+
+    def __init__(self, root=WORKSPACE_ROOT, session_id=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.path = os.path.join(root, self.session_id)
+        os.makedirs(self.path, exist_ok=True)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+    def add_document(self, data, document_type, suffix):
+        """Store document bytes and return its DocumentHandle."""
+        digest = hashlib.sha256(data).hexdigest()
+        self.touch()
+        path = os.path.join(self.path, digest + suffix)
+        if not os.path.exists(path):
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return DocumentHandle(digest, path, document_type)
+
+    def add_image(self, image):
+        """Store a PIL image (as PNG) and return its DocumentHandle."""
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return self.add_document(buffer.getvalue(), "image", ".png")
+
+    def remove_document(self, document):
+        """Delete one stored document."""
+        try:
+            os.remove(document.path)
+        except FileNotFoundError:
+            pass
+
+    def remove_documents(self, keep=()):
+        """Delete the stored documents except the handles in `keep`."""
+        keep_paths = {document.path for document in keep}
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if path not in keep_paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+
+    def touch(self):
+        # re-create the directory if another session reaped it as stale
+        os.makedirs(self.path, exist_ok=True)
+        os.utime(self.path)
+
+    def cleanup(self):
+        self._finalizer()
+
+
+def cleanup_stale_workspaces(root=WORKSPACE_ROOT, ttl=WORKSPACE_TTL):
+    """Remove the workspaces under `root` that have not been used for `ttl` seconds."""
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if now - os.path.getmtime(path) > ttl:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            # removed by another session meanwhile
+            continue
@@ -1,74 +1,55 @@
 import os
 import json
 from PIL import ImageDraw, Image
-from fuzzywuzzy import fuzz
-from tqdm import tqdm
 
 from surya.layout import LayoutPredictor
 
-from doctr.io import DocumentFile
 from doctr.models import ocr_predictor
 
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'application'))
+from ocr_store import compact_record_log, store_paths
+from ocr_cache import LAYOUT_CONFIG, OCRCache
+from ocr_utils import (BLOCK_TEXT_FROM_LINES, LAYOUT_BATCH_SIZE, extract_regions, get_batched_block_predictions,
+                       get_block_predictions)
+from sharded_runner import run_sharded
 
-layout_predictor = LayoutPredictor()
-model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
 
 JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/json/doctr_grounding_annotations.json"
 IMG_DIR = "/data/BADRI/FINAL/THESIS/GRVQA/ANNOTATION/final/"
 
 OUTPUT_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/intermediate/doctr_block_ocr_store.json"
+STORE_FILE, LOG_FILE = store_paths(OUTPUT_FILE)
 
+BLOCK_TEXT_MODE = BLOCK_TEXT_FROM_LINES
+REOCR_EMPTY_BLOCKS = False
 
 
-with open(JSON_FILE, 'r') as f:
-    data = json.load(f)
 
-output_data = {}
+def init_worker():
+    layout_predictor = LayoutPredictor()
+    model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+    return layout_predictor, model, OCRCache()
 
 
-for image_name, qa_data in tqdm(data.items()):
-    IMG_PATH = os.path.join(IMG_DIR, image_name)
+def process_images(state, image_names):
+    layout_predictor, model, ocr_cache = state
+    IMG_PATHS = [os.path.join(IMG_DIR, image_name) for image_name in image_names]
 
-
-    image = Image.open(IMG_PATH)
-
-    predictions = []
-
-    # layout_predictions is a list of dicts, one per image
-    layout_predictions = layout_predictor([image])
-
-    for block in layout_predictions[0].bboxes:
-        output = {}
-        bbox = [int(x) for x in block.bbox]
-        
-
-        cropped_image = image.crop(bbox)
-
-        cropped_image.save(f'temp.png')
-        doc = DocumentFile.from_images('temp.png')
-        result = model(doc)
-
-        text = []
-        for page in result.pages:
-            for block in page.blocks:
-                for line in block.lines:
-                    for word in line.words:
-                        text.append(word.value)
-
-
-        output['bbox'] = bbox
-        output['text'] = " ".join(text)
-        predictions.append(output)
-
-
-    output_data[image_name] = predictions
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(output_data, f, indent=4, ensure_ascii=False)
-
-
-with open(OUTPUT_FILE, 'w') as f:
-    json.dump(output_data, f, indent=4, ensure_ascii=False)
+    if BLOCK_TEXT_MODE == BLOCK_TEXT_FROM_LINES:
+        # the same cached single-pass extraction as get_doctr_ocr_data.py and the line store
+        records = extract_regions(IMG_PATHS, layout_predictor, model, cache=ocr_cache, reocr_empty=REOCR_EMPTY_BLOCKS)
+        return [record['block_predictions'] for record in records]
+    images = [Image.open(IMG_PATH) for IMG_PATH in IMG_PATHS]
+    return get_batched_block_predictions(images, layout_predictor, lambda index, image, block_bboxes: get_block_predictions(
+        image, layout_predictor, model, block_bboxes=block_bboxes), cache=ocr_cache, config=LAYOUT_CONFIG)
 
 
+if __name__ == "__main__":
+    with open(JSON_FILE, 'r') as f:
+        data = json.load(f)
 
+    run_sharded([(image_name, image_name) for image_name in data], init_worker, process_images, LOG_FILE,
+                batch_size=LAYOUT_BATCH_SIZE)
 
+    compact_record_log(LOG_FILE, OUTPUT_FILE, STORE_FILE, keys=data.keys())
@@ -1,78 +1,38 @@
 import os
 import json
-from fuzzywuzzy import fuzz
-from tqdm import tqdm
 
-from doctr.io import DocumentFile
 from doctr.models import ocr_predictor
 
-
-model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'application'))
+from ocr_store import compact_record_log, store_paths
+from ocr_cache import OCRCache
+from ocr_utils import extract_lines
+from sharded_runner import run_sharded
 
 
 JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/json/filtered_grounding_annotations.json"
 IMG_DIR = "/data/BADRI/FINAL/THESIS/GRVQA/ANNOTATION/final/"
 
 OUTPUT_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/intermediate/doctr_line_ocr_store.json"
+STORE_FILE, LOG_FILE = store_paths(OUTPUT_FILE)
 
 
+def init_worker():
+    model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
+    return model, OCRCache()
 
 
-with open(JSON_FILE, 'r') as f:
-    data = json.load(f)
-
-
-output_data = {}
-
-for image_name, qa_data in tqdm(data.items()):
-    IMG_PATH = os.path.join(IMG_DIR, image_name)
-    doc = DocumentFile.from_images(IMG_PATH)
-    result = model(doc)
-
-    predictions = []
-
-    for page in result.pages:     
-        dim = tuple(reversed(page.dimensions))
-        for block in page.blocks:
-            for line in block.lines:
-                output = {}
-                geo = line.geometry
-                a = list(a*b for a,b in zip(geo[0],dim))
-                b = list(a*b for a,b in zip(geo[1],dim))
-                x1 = round(a[0], 2).astype(float)
-                y1 = round(a[1], 2).astype(float)
-                x2 = round(b[0], 2).astype(float)
-                y2 = round(b[1], 2).astype(float)
-                line_bbox = [x1, y1, x2, y2]
-                
-                sent = []
-                words_data = []
-                for word in line.words:
-                    word_data = {}
-                    sent.append(word.value)
-                    geo = word.geometry
-                    a = list(a*b for a,b in zip(geo[0],dim))
-                    b = list(a*b for a,b in zip(geo[1],dim))
-                    x1 = round(a[0], 2).astype(float)
-                    y1 = round(a[1], 2).astype(float)
-                    x2 = round(b[0], 2).astype(float)
-                    y2 = round(b[1], 2).astype(float)
-                    bbox = [x1, y1, x2, y2]
-                    
-                    word_data['bbox'] = bbox
-                    word_data['text'] = word.value
-                    words_data.append(word_data)
-                output['bbox'] = line_bbox
-                output['text'] = " ".join(sent)
-                output['words'] = words_data
-                predictions.append(output)
-
-    output_data[image_name] = predictions
+def process_image(state, image_name):
+    model, ocr_cache = state
+    # docTR only (no layout pass); shares the "doctr_lines" cache entries with the block store and get_doctr_ocr_data.py
+    return extract_lines([os.path.join(IMG_DIR, image_name)], model, cache=ocr_cache)[0]
 
 
-    with open(OUTPUT_FILE, 'w') as f:
-        json.dump(output_data, f, indent=4, ensure_ascii=False)
+if __name__ == "__main__":
+    with open(JSON_FILE, 'r') as f:
+        data = json.load(f)
 
+    run_sharded([(image_name, image_name) for image_name in data], init_worker, process_image, LOG_FILE)
 
-with open(OUTPUT_FILE, 'w') as f:
-    json.dump(output_data, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+    compact_record_log(LOG_FILE, OUTPUT_FILE, STORE_FILE, keys=data.keys())
@@ -1,95 +1,38 @@
 from transformers import pipeline
 import pytesseract
-from PIL import Image
 import json
 import os
 from tqdm import tqdm
 
-from doctr.io import DocumentFile
 from doctr.models import ocr_predictor
 from surya.layout import LayoutPredictor
 
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'application'))
+from record_log import open_qa_journal, qa_journal_path
+from ocr_cache import OCRCache
+from ocr_utils import extract_lines, extract_page_regions
+
 model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
 layout_predictor = LayoutPredictor()
+ocr_cache = OCRCache()
 
 def perform_block_level_ocr(image_path):
 
-
-    image = Image.open(image_path)
-    predictions = []
-
-    # layout_predictions is a list of dicts, one per image
-    layout_predictions = layout_predictor([image])
-
-    for block in layout_predictions[0].bboxes:
-        output = {}
-        bbox = [int(x) for x in block.bbox]
-        
-
-        cropped_image = image.crop(bbox)
-
-        cropped_image.save(f'temp.png')
-        doc = DocumentFile.from_images('temp.png')
-        result = model(doc)
-
-        text = []
-        for page in result.pages:
-            for block in page.blocks:
-                for line in block.lines:
-                    for word in line.words:
-                        text.append(word.value)
-
-
-        output['bbox'] = bbox
-        output['text'] = " ".join(text)
-        predictions.append(output)
-    return predictions
+    blocks = extract_page_regions(image_path, layout_predictor, model, cache=ocr_cache)['block_predictions']
+    # only bbox and text go into the LLM context
+    return [{'bbox': block['bbox'], 'text': block['text']} for block in blocks]
 
 def perform_ocr(image_path):
-    
-    doc = DocumentFile.from_images(image_path)
-    result = model(doc)
 
-    predictions = []
+    # docTR only: the line context needs no layout pass
+    lines = extract_lines([image_path], model, cache=ocr_cache)[0]
 
-    for page in result.pages:     
-        dim = tuple(reversed(page.dimensions))
-        for block in page.blocks:
-            for line in block.lines:
-                output = {}
-                geo = line.geometry
-                a = list(a*b for a,b in zip(geo[0],dim))
-                b = list(a*b for a,b in zip(geo[1],dim))
-                x1 = str(int(round(a[0], 2).astype(float)))
-                y1 = str(int(round(a[1], 2).astype(float)))
-                x2 = str(int(round(b[0], 2).astype(float)))
-                y2 = str(int(round(b[1], 2).astype(float)))
-                # line_bbox = [x1, y1, x2, y2]
-                bbox = x1 + " " + y1 + " " + x2 + " " + y2
-                
-                sent = [bbox]
-                for word in line.words:
-                    sent.append(word.value)
-                # words_data = []
-                # for word in line.words:
-                #     word_data = {}
-                #     sent.append(word.value)
-                #     geo = word.geometry
-                #     a = list(a*b for a,b in zip(geo[0],dim))
-                #     b = list(a*b for a,b in zip(geo[1],dim))
-                #     x1 = round(a[0], 2).astype(float)
-                #     y1 = round(a[1], 2).astype(float)
-                #     x2 = round(b[0], 2).astype(float)
-                #     y2 = round(b[1], 2).astype(float)
-                #     bbox = [x1, y1, x2, y2]
-                    
-                #     word_data['bbox'] = bbox
-                #     word_data['text'] = word.value
-                #     words_data.append(word_data)
-                # output['bbox'] = line_bbox
-                output = " ".join(sent)
-                # output['words'] = words_data
-                predictions.append(output)
+    predictions = []
+    for line in lines:
+        # "x1 y1 x2 y2" followed by the words of the line
+        line_bbox = [str(int(x)) for x in line['bbox']]
+        predictions.append(" ".join(line_bbox + [word['text'] for word in line['words']]))
     return predictions
 
 def load_llm_model(device):
@@ -145,18 +88,27 @@ INPUT_JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/json/doctr_llama_
 OUTPUT_JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/json/doctr_llama_grounding_annotations.json"
 IMG_DIR = "/data/BADRI/FINAL/THESIS/GRVQA/ANNOTATION/final/"
 
+JOURNAL_FILE = qa_journal_path(OUTPUT_JSON_FILE)
+
 LEVEL = "block"
 
 with open(INPUT_JSON_FILE, 'r') as f:
     data = json.load(f)
 
+journal = open_qa_journal(JOURNAL_FILE, data)
+
     
 
 
 pipe = load_llm_model("cuda")
 
 
+PREDICTIONS_FIELD = 'block_level_predictions' if LEVEL == "block" else 'line_level_predictions'
+
 for image_name, qa_data in tqdm(data.items()):
+    # every QA of this image is already in the journal: skip its OCR too
+    if all(qa.get(PREDICTIONS_FIELD) is not None for qa in qa_data):
+        continue
     image_path  = os.path.join(IMG_DIR, image_name)
     if LEVEL == "block":
         predictions = perform_block_level_ocr(image_path)
@@ -177,6 +129,7 @@ for image_name, qa_data in tqdm(data.items()):
             except:
                 qa['block_level_predictions'] = grounding_answer
                 print(qa['id'])
+            journal.append(qa['id'], {'block_level_predictions': qa['block_level_predictions']})
         else:
             if 'line_level_predictions' in qa and qa['line_level_predictions'] is not None:
                 continue
@@ -189,10 +142,9 @@ for image_name, qa_data in tqdm(data.items()):
             except:
                 qa['line_level_predictions'] = grounding_answer
                 print(qa['id'])
+            journal.append(qa['id'], {'line_level_predictions': qa['line_level_predictions']})
+
+journal.close()
 
-        # save json file dynamically
-        with open(OUTPUT_JSON_FILE, 'w') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    
 with open(OUTPUT_JSON_FILE, 'w') as f:
     json.dump(data, f, indent=4, ensure_ascii=False)
@@ -4,10 +4,14 @@ import torch
 import json
 from tqdm import tqdm
 import os
+import sys
 
 from doctr.io import DocumentFile
 from doctr.models import ocr_predictor
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'application'))
+from record_log import open_qa_journal, qa_journal_path
+
 model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
 
 
@@ -84,10 +88,13 @@ def custom_hf_inference(messages):
 INPUT_JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/json/filtered_grounding_annotations.json"
 IMG_DIR = "/data/BADRI/FINAL/THESIS/GRVQA/ANNOTATION/final/"
 OUT_JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/json/qwen_grounding_annotations.json"
+JOURNAL_FILE = qa_journal_path(OUT_JSON_FILE)
 
 with open(INPUT_JSON_FILE, 'r') as f:
     data = json.load(f)
 
+journal = open_qa_journal(JOURNAL_FILE, data)
+
 
 for image_name, qa_data in tqdm(data.items()):
     image_path  = os.path.join(IMG_DIR, image_name)
@@ -139,10 +146,9 @@ for image_name, qa_data in tqdm(data.items()):
             print(grounding_answer)
             print(qa['id'])
             # exit()
+        journal.append(qa['id'], {'line_level_predictions': qa['line_level_predictions']})
+
+journal.close()
 
-        # save json file dynamically
-        with open(OUT_JSON_FILE, 'w') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    
 with open(OUT_JSON_FILE, 'w') as f:
     json.dump(data, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import resource
+import multiprocessing
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'application'))
+from ocr_store import import_json
+
+
+# Compare the JSON OCR store with the columnar store: time and peak RSS to look up images
+JSON_FILE = "/data/BADRI/FINAL/THESIS/GRVQA/main/outputs/intermediate/doctr_line_ocr_store.json"
+STORE_DIR = os.path.splitext(JSON_FILE)[0] + ".ocr"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (VmHWM), falling back to ru_maxrss."""
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(kind, lookup, queue):
+    import json
+    from ocr_store import OCRStore
+
+    base_rss = peak_rss_mb()
+    start = time.perf_counter()
+    if kind == "json":
+        with open(JSON_FILE, 'r') as f:
+            ocr_data = json.load(f)
+    else:
+        ocr_data = OCRStore(STORE_DIR)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_names = list(ocr_data.keys())
+    if lookup == "one":
+        image_names = image_names[len(image_names) // 2:len(image_names) // 2 + 1]
+    regions = 0
+    for image_name in image_names:
+        regions += len(ocr_data[image_name])
+    lookup_time = time.perf_counter() - start
+
+    rss = peak_rss_mb() - base_rss
+    queue.put((load_time, lookup_time, rss, regions))
+
+
+def measure(kind, lookup):
+    """Run one measurement in a fresh process so peak RSS is not shared between runs."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(kind, lookup, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    if not os.path.isdir(STORE_DIR):
+        import_json(JSON_FILE, STORE_DIR)
+
+    json_size = os.path.getsize(JSON_FILE) / 2**20
+    store_size = sum(os.path.getsize(os.path.join(STORE_DIR, name)) for name in os.listdir(STORE_DIR)) / 2**20
+    print(f"JSON file: {json_size:.1f} MB, columnar store: {store_size:.1f} MB")
+    print(f"{'format':<8}{'lookup':<8}{'open (s)':>10}{'lookup (s)':>12}{'peak RSS (MB)':>15}{'regions':>10}")
+    for kind in ("json", "store"):
+        for lookup in ("one", "all"):
+            load_time, lookup_time, rss, regions = measure(kind, lookup)
+            print(f"{kind:<8}{lookup:<8}{load_time:>10.3f}{lookup_time:>12.3f}{rss:>15.1f}{regions:>10}")